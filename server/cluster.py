@@ -0,0 +1,123 @@
+""" Sharded server helpers. Games are pinned to server worker processes by game name, connections are handed off
+between worker processes on LOGIN.
+"""
+import array
+import json
+import multiprocessing.managers
+import os
+import socket
+import zlib
+
+from db.session import engine
+from logger import log
+
+
+def close_fds(fds):
+    """ Closes file descriptors inherited by forked helper process.
+    """
+    for fd in fds:
+        os.close(fd)
+
+
+class Cluster(object):
+    """ Shared state of server worker processes. Has to be created before forking of the workers.
+
+    Each worker has a datagram channel which is used to pass accepted sockets (with already received data)
+    to the worker. Active games of all workers are published to the shared registry.
+    """
+
+    MAX_HAND_OFF_SIZE = 65536
+
+    def __init__(self, num_workers, listening_socks=()):
+        self.num_workers = num_workers
+        self.worker_idx = None
+        # The manager's process is forked, it should not keep the listening sockets open:
+        self.manager = multiprocessing.managers.SyncManager(ctx=multiprocessing.get_context('fork'))
+        self.manager.start(close_fds, ([sock.fileno() for sock in listening_socks], ))
+        self.games = self.manager.dict()
+        self.channels = [socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM) for _ in range(num_workers)]
+
+    def start_worker(self, worker_idx):
+        """ Initializes the worker process after fork.
+        """
+        self.worker_idx = worker_idx
+        # The worker receives connections by its own channel and sends them by channels of other workers:
+        for idx, (receiver, sender) in enumerate(self.channels):
+            if idx == worker_idx:
+                sender.close()
+            else:
+                receiver.close()
+        # Connections of the DB pool can't be shared between processes:
+        engine.dispose()
+
+    def get_game_owner(self, game_name):
+        """ Returns index of the worker which owns the game.
+        """
+        return zlib.crc32(game_name.encode('utf-8')) % self.num_workers
+
+    def is_game_owner(self, game_name):
+        return self.get_game_owner(game_name) == self.worker_idx
+
+    def hand_off(self, worker_idx, fd, client_address, data=b''):
+        """ Passes connection's socket descriptor and already received data to the worker.
+        """
+        header = json.dumps(client_address).encode('utf-8')
+        message = len(header).to_bytes(4, byteorder='little') + header + data
+        if len(message) > self.MAX_HAND_OFF_SIZE:
+            raise ValueError('Too much data to hand off the connection')
+        _, sender = self.channels[worker_idx]
+        sender.sendmsg([message], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', [fd]))])
+        log.debug('Connection from {} handed off to worker {}'.format(client_address, worker_idx))
+
+    def receive_hand_off(self):
+        """ Waits for connection handed off to the current worker.
+        returns: socket, client address and already received data
+        """
+        receiver, _ = self.channels[self.worker_idx]
+        fds = array.array('i')
+        message, ancdata, _, _ = receiver.recvmsg(
+            self.MAX_HAND_OFF_SIZE, socket.CMSG_SPACE(fds.itemsize))
+        for level, cmsg_type, cmsg_data in ancdata:
+            if level == socket.SOL_SOCKET and cmsg_type == socket.SCM_RIGHTS:
+                fds.frombytes(cmsg_data[:len(cmsg_data) - (len(cmsg_data) % fds.itemsize)])
+        try:
+            header_len = int.from_bytes(message[:4], byteorder='little')
+            client_address = json.loads(message[4:4 + header_len].decode('utf-8'))
+        except Exception:
+            close_fds(fds)
+            raise
+        sock = socket.socket(fileno=fds[0])
+        return sock, tuple(client_address), message[4 + header_len:]
+
+    def serve_hand_offs(self, adopt_connection):
+        """ Receives handed off connections and passes them to the server. Runs in separate thread.
+        """
+        while True:
+            try:
+                adopt_connection(*self.receive_hand_off())
+            except Exception:
+                log.exception('Unable to adopt handed off connection')
+
+    def publish_games(self, games):
+        """ Publishes active games of the current worker.
+        """
+        self.games[self.worker_idx] = games
+
+    def get_all_active_games(self):
+        """ Returns active games of all workers.
+        """
+        games = []
+        for worker_games in self.games.values():
+            games.extend(worker_games)
+        return games
+
+    def close_channels(self):
+        """ Closes channels of the workers, the main process does not use them after fork of the workers.
+        """
+        for receiver, sender in self.channels:
+            receiver.close()
+            sender.close()
+
+    def close(self):
+        self.close_channels()
+        self.manager.shutdown()
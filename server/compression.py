@@ -0,0 +1,23 @@
+""" Compression of response messages.
+"""
+import zlib
+
+from config import CONFIG
+
+
+class CompressedMessage(bytes):
+    """ Response message compressed by zlib.
+    """
+    pass
+
+
+def compress(message):
+    """ Compresses the message if it is large enough.
+    returns: CompressedMessage or the message itself
+    """
+    if isinstance(message, CompressedMessage):
+        return message
+    data = message.encode('utf-8') if isinstance(message, str) else message
+    if data is None or len(data) < CONFIG.COMPRESSION_THRESHOLD:
+        return message
+    return CompressedMessage(zlib.compress(data, CONFIG.COMPRESSION_LEVEL))
@@ -2,6 +2,8 @@
 """
 from os import getenv
 
+from defs import Action
+
 try:
     from settings_local import LocalConfig as Config
 except ImportError as e:
@@ -18,6 +20,12 @@ class TestingConfig(Config):
     TRAIN_ALWAYS_DEVASTATED = False  # There is at least one test which awaits non-devastated train, TODO: check it
     MAX_LINE_LENGTH = 1000
     FUEL_ENABLED = True
+    MAX_CONNECTIONS = 64
+    READ_TIMEOUT = 2
+    RATE_LIMIT = None
+    ACTION_RATE_LIMITS = {
+        Action.GAMES: (5, 10),
+    }
 
 
 class TestingConfigWithEvents(TestingConfig):
@@ -1,6 +1,6 @@
 """ Server definitions.
 """
-from enum import IntEnum
+from enum import IntEnum, IntFlag
 
 
 class Action(IntEnum):
@@ -13,7 +13,10 @@ class Action(IntEnum):
     TURN = 5
     PLAYER = 6
     GAMES = 7
+    BATCH = 8
+    SUBSCRIBE = 9
     MAP = 10
+    RESUME = 11
 
     # Observer actions:
     OBSERVER = 100
@@ -32,4 +35,29 @@ class Result(IntEnum):
     ACCESS_DENIED = 3
     INAPPROPRIATE_GAME_STATE = 4
     TIMEOUT = 5
+    THROTTLED = 6
     INTERNAL_SERVER_ERROR = 500
+
+
+class ActionFlag(IntFlag):
+    """ Flags of client commands, sent in high bits of action code.
+    """
+    REQUEST_ID = 1 << 16
+    SESSION_ID = 1 << 17
+
+
+class ResultFlag(IntFlag):
+    """ Flags of server responses, sent in high bits of result code.
+    """
+    COMPRESSED = 1 << 16
+    NOTIFICATION = 1 << 17
+    REQUEST_ID = 1 << 18
+    SESSION_ID = 1 << 19
+
+
+class Encoding(IntEnum):
+    """ Wire encodings of server responses.
+    """
+    JSON = 1
+    COMPACT_JSON = 2
+    MSGPACK = 3
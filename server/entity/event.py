@@ -17,7 +17,9 @@ class EventType(IntEnum):
 
 class Event(Serializable):
     """ Event entity defined by: EventType, game tick and additional info.
+    Set of the event's attributes depends on the info, so they are kept in __dict__.
     """
+
     def __init__(self, event_type: EventType, tick, **kwargs):
         self.type = event_type
         self.tick = tick
@@ -26,7 +28,7 @@ class Event(Serializable):
             setattr(self, key, value)
 
     def to_dict(self):
-        return self.__dict__
+        return self.default_serializer(self)
 
     def __repr__(self):
         return '<Event(type={}, tick={})>'.format(self.type, self.tick)
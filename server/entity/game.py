@@ -1,20 +1,27 @@
 """ Game entity.
 """
+import itertools
 import math
 import random
+import secrets
+from collections import deque
+from concurrent.futures import Future
 from contextlib import contextmanager
 from enum import IntEnum
-from threading import Thread, Event, Lock, Condition
+from functools import wraps
+from threading import Thread, Event, Lock, RLock
 
 import errors
+from compression import compress
 from config import CONFIG
 from db import game_db
-from defs import Action
+from defs import Action, Encoding
 from entity.event import EventType, Event as GameEvent
 from entity.map import Map
 from entity.player import Player
 from entity.point import Point
 from entity.post import PostType, Post
+from entity.serializable import Message
 from entity.train import Train
 from logger import log
 
@@ -27,9 +34,25 @@ class GameState(IntEnum):
     FINISHED = 3
 
 
+def changes_state(func):
+    """ Marks the game's method which changes dynamic game entities, so cached map layers are re-serialized.
+    """
+    @wraps(func)
+    def wrapped(self, *args, **kwargs):
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            # The version is changed after the entities are changed (even if the method failed in the middle):
+            self.state_version = next(self._state_versions)
+    return wrapped
+
+
 class Game(Thread):
 
     GAMES = {}  # All registered games.
+    CLUSTER = None  # Shared state of server processes, used by sharded server only.
+    # Map attributes (of layer 1) with entities which changes are sent to clients requesting changes since some tick:
+    STAMPED_ENTITIES = ('posts', 'trains', 'ratings')
 
     def __init__(
             self, name, observed=False, map_name=None,
@@ -56,13 +79,31 @@ class Game(Thread):
                 name, self.map.idx, num_players=num_players, num_turns=num_turns
             )
         self.players = {}
+        self.resume_tokens = {}
         self.trains = {}
         self.next_train_moves = {}
         self.event_cooldowns = CONFIG.EVENT_COOLDOWNS_ON_START.copy()
-        self._lock = Lock()
+        # Reentrant: the game is finished by the game loop and by removal of the last player, both hold the lock:
+        self._lock = RLock()
+        # Serialized dynamic map layers are cached until the game state is changed:
+        self._state_versions = itertools.count(1)
+        self.state_version = 0
+        self._layers_lock = Lock()
+        self._cached_layers = {}
+        # Tick notifications are serialized once per tick for all subscribers, key: layer, encoding:
+        self._tick_notifications = (None, {})
+        # Changes of entities are stamped on each tick and on requests of changes since some tick,
+        # key: map attribute and entity idx. Stamping is started by the first request of changes:
+        self._change_stamps = itertools.count(1)
+        self._stamped_version = None
+        self._entity_snapshots = {}
+        self._entity_stamps = {}
+        self._removal_stamps = {}
+        self._tick_stamps = None  # Tick number and stamp of changes made by the tick, for recent ticks only.
         self._stop_event = Event()
         self._start_tick_event = Event()
-        self._tick_done_condition = Condition()
+        self._tick_done_futures = []
+        self._tick_subscribers = []
         random.seed()
 
     def __repr__(self):
@@ -82,12 +123,28 @@ class Game(Thread):
             game = Game.GAMES[name]
         else:
             Game.GAMES[name] = game = Game(name, **kwargs)
+            Game.publish_games()
         return game
 
     @staticmethod
     def get_all_active_games():
         """ Returns parameters of all non-finished games.
         """
+        if Game.CLUSTER is not None:
+            return Game.CLUSTER.get_all_active_games()
+        return Game.get_local_active_games()
+
+    @staticmethod
+    def publish_games():
+        """ Publishes non-finished games of the current process to other server processes.
+        """
+        if Game.CLUSTER is not None:
+            Game.CLUSTER.publish_games(Game.get_local_active_games())
+
+    @staticmethod
+    def get_local_active_games():
+        """ Returns parameters of non-finished games of the current process.
+        """
         games = []
         for game in Game.GAMES.values():
             if game.state != GameState.FINISHED:
@@ -108,6 +165,16 @@ class Game(Thread):
         for game_name in list(Game.GAMES.keys()):
             Game.GAMES.pop(game_name).delete()
 
+    @staticmethod
+    def stop_waiting_games():
+        """ Stops games which are waiting for players. Uses on server draining: the successor server process
+        accepts new connections, so the games would never be started by this process.
+        """
+        for game in list(Game.GAMES.values()):
+            if game.state == GameState.INIT:
+                log.warn('Stopping game waiting for players', game=game)
+                game.delete()
+
     def check_state(self, *states):
         """ Checks is state of the game corresponds to any specified state, raises error if not.
         """
@@ -116,6 +183,7 @@ class Game(Thread):
         else:
             raise errors.InappropriateGameState('Inappropriate game state: {!r}'.format(self.state))
 
+    @changes_state
     def add_player(self, player: Player):
         """ Adds player to the game.
         """
@@ -123,6 +191,8 @@ class Game(Thread):
         if player.idx in self.players:
             player = self.players[player.idx]
             player.in_game = True
+            if player.resume_token is None:
+                self.issue_resume_token(player)
             return player
 
         # Add new player to the game:
@@ -134,6 +204,7 @@ class Game(Thread):
             else:
                 self.players[player.idx] = player
                 player.in_game = True
+                self.issue_resume_token(player)
 
             # Pick first available Town on the map as player's Town:
             player_town = [t for t in self.map.towns if t.player_idx is None][0]
@@ -168,23 +239,63 @@ class Game(Thread):
 
         return player
 
-    def remove_player(self, player: Player):
-        """ Removes player from the game.
+    def issue_resume_token(self, player: Player):
+        """ Issues new resumption token of the player, the previous one is not valid anymore.
         """
+        with self._lock:
+            self.resume_tokens.pop(player.resume_token, None)
+            player.resume_token = secrets.token_urlsafe(CONFIG.RESUME_TOKEN_BYTES)
+            self.resume_tokens[player.resume_token] = player
+
+    def resume_player(self, resume_token):
+        """ Returns player of the game to the game by the resumption token issued on adding of the player.
+        The token can be used once, the player gets new token.
+        returns: the player or None if the token is not valid
+        """
+        with self._lock:
+            player = self.resume_tokens.get(resume_token, None)
+            if player is not None:
+                player.in_game = True
+                self.issue_resume_token(player)
+        return player
+
+    def remove_player(self, player: Player, logout=False):
+        """ Removes player from the game. The player who is logged out can't return to the game by RESUME.
+        """
+        if logout:
+            with self._lock:
+                self.resume_tokens.pop(player.resume_token, None)
+                player.resume_token = None
         player.in_game = False
         self.delete_if_no_players()
 
     def turn(self, player: Player):
         """ Makes next turn.
+        returns: future which is resolved by the game loop when the tick is done
         """
-        with self._tick_done_condition:
-            with self._lock:
-                player.turn_called = True
-                all_ready_for_turn = all([p.turn_called for p in self.players.values()])
-                if all_ready_for_turn:
-                    self._start_tick_event.set()
-            if not self._tick_done_condition.wait(CONFIG.TURN_TIMEOUT):
-                raise errors.Timeout('Game tick did not happen')
+        tick_done = Future()
+        tick_done.set_running_or_notify_cancel()  # The future can't be cancelled by waiters.
+        with self._lock:
+            if self.is_finished:
+                tick_done.set_exception(errors.InappropriateGameState('The game is finished'))
+                return tick_done
+            player.turn_called = True
+            self._tick_done_futures.append(tick_done)
+            all_ready_for_turn = all([p.turn_called for p in self.players.values()])
+            if all_ready_for_turn:
+                self._start_tick_event.set()
+        return tick_done
+
+    def subscribe(self, callback):
+        """ Registers the callback which is called by the game loop after each tick.
+        """
+        with self._lock:
+            self._tick_subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._tick_subscribers:
+                self._tick_subscribers.remove(callback)
 
     def start(self):
         """ Starts game ticks (game loop).
@@ -193,6 +304,7 @@ class Game(Thread):
         self.state = GameState.RUN
         if not self.observed:
             super().start()
+            Game.publish_games()
 
     def finish(self):
         """ Stops game ticks (game loop).
@@ -200,8 +312,14 @@ class Game(Thread):
         log.info('Finishing game', game=self)
         self.state = GameState.FINISHED
         self._stop_event.set()
+        # Next tick will never happen:
+        with self._lock:
+            tick_done_futures, self._tick_done_futures = self._tick_done_futures, []
+        for tick_done in tick_done_futures:
+            tick_done.set_exception(errors.InappropriateGameState('The game is finished'))
         if not self.observed:
             game_db.update_game_data(self.game_idx, self.map.ratings)
+            Game.publish_games()
 
     def delete(self):
         """ Stops and deletes the game.
@@ -210,6 +328,7 @@ class Game(Thread):
             self.finish()
         if self.name in Game.GAMES:
             Game.GAMES.pop(self.name)
+            Game.publish_games()
 
     def delete_if_no_players(self):
         """ Stops the game if there are no 'in_game' players.
@@ -224,11 +343,9 @@ class Game(Thread):
         """
         map(lambda p: p.lock.acquire(), self.players.values())
         self._lock.acquire()
-        self._tick_done_condition.acquire()
         try:
             yield
         finally:
-            self._tick_done_condition.release()
             self._lock.release()
             map(lambda p: p.lock.release(), self.players.values())
 
@@ -240,17 +357,27 @@ class Game(Thread):
             with self._turn_ctx():
                 if self.state != GameState.RUN:
                     break  # Finish game thread.
+                tick_done_futures, self._tick_done_futures = self._tick_done_futures, []
                 try:
                     self.tick()
-                except Exception:
+                except Exception as err:
                     log.exception('Got unhandled exception on tick', game=self)
+                    for tick_done in tick_done_futures:
+                        tick_done.set_exception(err)
                     raise
                 if self._start_tick_event.is_set():
                     self._start_tick_event.clear()
                 for player in self.players.values():
                     player.turn_called = False
-                self._tick_done_condition.notify_all()
-
+                for tick_done in tick_done_futures:
+                    tick_done.set_result(self.current_tick)
+                for callback in self._tick_subscribers:
+                    try:
+                        callback()
+                    except Exception:
+                        log.exception('Got unhandled exception on tick notification', game=self)
+
+    @changes_state
     def tick(self):
         """ Makes game tick. Updates dynamic game entities.
         """
@@ -269,6 +396,8 @@ class Game(Thread):
         self.parasites_assault_on_tick()
         self.recalculate_ratings_on_tick()
         self.retire_events_on_tick()
+        if self._tick_stamps is not None:
+            self._tick_stamps.append((self.current_tick, self.stamp_changes()))
 
         if not self.observed:
             game_db.add_action(self.game_idx, Action.TURN)
@@ -315,6 +444,7 @@ class Game(Thread):
         else:
             train.speed = 0
 
+    @changes_state
     def move_train(self, player, train_idx, speed, line_idx):
         """ Process action MOVE. Changes path or speed of the Train.
         """
@@ -471,6 +601,7 @@ class Game(Thread):
             player_town = self.players[train.player_idx].town
             train.cooldown = player_town.train_cooldown
 
+    @changes_state
     def make_hijackers_assault(self, hijackers_power):
         """ Makes hijackers assault which decreases quantity of Town's armor and population.
         """
@@ -497,6 +628,7 @@ class Game(Thread):
             hijackers_power = random.randint(*CONFIG.HIJACKERS_POWER_RANGE)
             self.make_hijackers_assault(hijackers_power)
 
+    @changes_state
     def make_parasites_assault(self, parasites_power):
         """ Makes parasites assault which decreases quantity of Town's product.
         """
@@ -522,6 +654,7 @@ class Game(Thread):
             parasites_power = random.randint(*CONFIG.PARASITES_POWER_RANGE)
             self.make_parasites_assault(parasites_power)
 
+    @changes_state
     def make_refugees_arrival(self, refugees_number):
         """ Makes refugees arrival which increases quantity of Town's population.
         """
@@ -684,6 +817,7 @@ class Game(Thread):
         for pair in collision_pairs:
             self.make_collision(*pair)
 
+    @changes_state
     def make_upgrade(self, player: Player, posts_idx=(), trains_idx=()):
         """ Upgrades given Posts and Trains to next level.
         """
@@ -740,26 +874,154 @@ class Game(Thread):
             train.set_level(train.level + 1)
             log.info('Train has been upgraded, post: {}'.format(train), game=self)
 
-    def get_map_layer(self, player, layer):
-        """ Returns specified game map layer.
+    def get_map_layer(self, player, layer, encoding=Encoding.JSON, compression=False, since_tick=None):
+        """ Returns specified game map layer serialized to given encoding, large layers are compressed if requested.
+        Only changes of the dynamic layer made after the tick are returned if since_tick is specified.
         """
-        if layer not in self.map.LAYERS or (layer in CONFIG.HIDDEN_MAP_LAYERS and not self.observed):
-            raise errors.ResourceNotFound('Map layer not found, layer: {}'.format(layer))
+        self.check_map_layer(layer)
 
         log.debug('Load game map layer, layer: {}'.format(layer), game=self)
-        message = self.map.layer_to_json_str(layer)
+        if since_tick is not None:
+            if layer in self.map.STATIC_LAYERS:
+                raise errors.BadCommand('Changes since the tick are available for dynamic map layers only')
+            if type(since_tick) is not int or not 0 <= since_tick <= self.current_tick:
+                raise errors.BadCommand(
+                    'Invalid tick, since_tick: {!r}, current tick: {}'.format(since_tick, self.current_tick))
+            message = self.serialize_layer_changes(since_tick, encoding, compression)
+        elif layer in self.map.STATIC_LAYERS:
+            message = self.map.serialize_layer(layer, encoding, compression)
+        else:
+            message = self.serialize_dynamic_layer(layer, encoding, compression)
 
         if layer == 1 and not self.observed:
             self.clean_user_events(player)
 
         return message
 
+    def serialize_dynamic_layer(self, layer, encoding, compression):
+        """ Returns serialized dynamic map layer, the layer is serialized once for each version of the game state.
+        Concurrent requests wait for the layer being serialized and share it.
+        """
+        key = (layer, encoding, compression)
+        with self._layers_lock:
+            state_version = self.state_version
+            cached_version, message = self._cached_layers.get(key, (None, None))
+            if cached_version != state_version:
+                message = self.map.serialize_layer(layer, encoding, compression)
+                self._cached_layers[key] = (state_version, message)
+        return message
+
+    def check_map_layer(self, layer):
+        """ Checks the game map layer is available for players (or observers), raises error if not.
+        """
+        if layer not in self.map.LAYERS or (layer in CONFIG.HIDDEN_MAP_LAYERS and not self.observed):
+            raise errors.ResourceNotFound('Map layer not found, layer: {}'.format(layer))
+
+    def serialize_layer_changes(self, since_tick, encoding, compression):
+        """ Returns serialized entities of map layer 1 which are changed after the tick, indexes of removed entities
+        and the current tick. If changes since the tick are not known (the tick is older than MAX_CHANGES_TICKS
+        or changes were not requested before), all entities of the layer are returned.
+        """
+        # The lock is held by the game loop during the tick, so the changes are consistent with the current tick:
+        with self._lock:
+            if self._tick_stamps is None:
+                self._tick_stamps = deque(maxlen=CONFIG.MAX_CHANGES_TICKS)
+            if self._stamped_version != self.state_version:
+                self.stamp_changes()
+            since_stamp = self.get_tick_stamp(since_tick)
+            full = since_stamp is None
+            if full:
+                since_stamp = 0  # All entities are stamped after the start.
+            changed = {
+                attribute: {
+                    idx: entity for idx, entity in getattr(self.map, attribute).items()
+                    # Entities which are added after the changes are stamped are new for the client:
+                    if self._entity_stamps.get((attribute, idx), math.inf) > since_stamp
+                } for attribute in self.STAMPED_ENTITIES
+            }
+            removed = {attribute: [] for attribute in self.STAMPED_ENTITIES}
+            for (attribute, idx), stamp in self._removal_stamps.items():
+                if stamp > since_stamp and not full:
+                    removed[attribute].append(idx)
+            changes = Message()
+            changes.set_attributes(
+                idx=self.map.idx, tick=self.current_tick, posts=list(changed['posts'].values()),
+                trains=list(changed['trains'].values()), ratings=changed['ratings'], removed=removed, full=full
+            )
+            message = changes.serialize(encoding)
+        return compress(message) if compression else message
+
+    def get_tick_stamp(self, tick):
+        """ Returns stamp of changes made by the tick, None if the tick is not stamped.
+        """
+        if self._tick_stamps:
+            first_tick, _ = self._tick_stamps[0]
+            if first_tick <= tick < first_tick + len(self._tick_stamps):
+                _, stamp = self._tick_stamps[tick - first_tick]
+                return stamp
+        return None
+
+    def stamp_changes(self):
+        """ Compares entities of map layer 1 with their snapshots taken by previous call, stamps changed entities.
+        returns: the stamp
+        """
+        stamp = next(self._change_stamps)
+        self._stamped_version = self.state_version
+        existing = set()
+        for attribute in self.STAMPED_ENTITIES:
+            for idx, entity in getattr(self.map, attribute).items():
+                key = (attribute, idx)
+                existing.add(key)
+                snapshot = self.take_snapshot(entity)
+                if self._entity_snapshots.get(key, None) != snapshot:
+                    self._entity_snapshots[key] = snapshot
+                    self._entity_stamps[key] = stamp
+                    self._removal_stamps.pop(key, None)
+        for key in self._entity_snapshots.keys() - existing:
+            self._entity_snapshots.pop(key)
+            self._entity_stamps.pop(key)
+            self._removal_stamps[key] = stamp
+        return stamp
+
+    @staticmethod
+    def take_snapshot(entity):
+        """ Returns comparable copy of serializable attributes of the entity (lists are copied into tuples).
+        """
+        attributes = entity if isinstance(entity, dict) else entity.default_serializer(entity)
+        return tuple(
+            (name, tuple(value) if isinstance(value, list) else value) for name, value in attributes.items()
+        )
+
+    def get_tick_notification(self, player, layer=None, encoding=Encoding.JSON):
+        """ Returns notification about the tick, the notification contains specified game map layer if requested.
+        The notification is serialized once per tick for all subscribers requesting the same layer and encoding.
+        """
+        key = (layer, encoding)
+        with self._layers_lock:
+            tick, notifications = self._tick_notifications
+            if tick != self.current_tick:
+                notifications = {}
+                self._tick_notifications = (self.current_tick, notifications)
+            message = notifications.get(key, None)
+            if message is None:
+                notification = Message()
+                notification.set_attributes(tick=self.current_tick)
+                if layer is not None:
+                    notification.set_attributes(map=self.map.layer_to_dict(layer))
+                message = notifications[key] = notification.serialize(encoding)
+        if layer == 1:
+            self.clean_user_events(player)
+        return message
+
     def clean_user_events(self, player):
         """ Cleans all existing event messages for particular user.
         """
+        if not player.town.events and not any(train.events for train in player.trains.values()):
+            return
         for train in player.trains.values():
             train.events = []
         player.town.events = []
+        self.state_version = next(self._state_versions)
 
     def update_cooldowns_on_tick(self):
         """ Decreases all cooldown values on game tick.
@@ -6,6 +6,9 @@ from entity.serializable import Serializable
 class Line(Serializable):
     """ Line entity defined by: two points (p0, p1), length, unique id.
     """
+
+    __slots__ = ('idx', 'length', 'points', )
+
     def __init__(self, idx, length, p0, p1):
         self.idx = idx
         self.length = length
@@ -6,7 +6,9 @@ from sqlalchemy.sql.expression import true
 
 import errors
 from db.models import Map as MapModel, Line as LineModel, Point as PointModel, Post as PostModel
+from compression import compress
 from db.session import session_ctx
+from defs import Encoding
 from entity.line import Line
 from entity.point import Point
 from entity.post import Post, PostType
@@ -17,6 +19,15 @@ class Map(Serializable):
 
     DICT_TO_LIST = {'points', 'lines', 'posts', 'trains', 'coordinates'}
     LAYERS = {0, 1, 10}
+    STATIC_LAYERS = {0, 10}
+    LAYER_ATTRIBUTES = {
+        0: {'idx', 'name', 'points', 'lines'},
+        1: {'idx', 'posts', 'trains', 'ratings'},
+        10: {'idx', 'size', 'coordinates'},
+    }
+    # Serialized static layers shared by all games and observers of the process,
+    # key: map idx, map name (idx is reused when the DB is re-created), layer, encoding, compression:
+    STATIC_LAYERS_CACHE = {}
 
     def __init__(self, name=None, use_active=False):
         self.name = name
@@ -78,18 +89,46 @@ class Map(Serializable):
 
             self.initialized = True
 
+        self.cache_static_layers()
+
     def add_train(self, train):
         self.trains[train.idx] = train
 
+    def serialize_layer(self, layer, encoding=Encoding.JSON, compression=False):
+        """ Serializes the layer, static layers are serialized (and compressed) once for each map.
+        """
+        if layer not in self.STATIC_LAYERS:
+            message = self.serialize_layer_attributes(layer, encoding)
+            return compress(message) if compression else message
+        key = (self.idx, self.name, layer, encoding, compression)
+        message = self.STATIC_LAYERS_CACHE.get(key, None)
+        if message is not None:
+            return message
+        if compression:
+            # Compressed variant is made from the serialized layer:
+            message = compress(self.serialize_layer(layer, encoding))
+        else:
+            message = self.serialize_layer_attributes(layer, encoding)
+            # Static layers are kept encoded, so responses are written as is:
+            if isinstance(message, str):
+                message = message.encode('utf-8')
+        # The layer could be serialized concurrently, the first one is kept:
+        return self.STATIC_LAYERS_CACHE.setdefault(key, message)
+
+    def cache_static_layers(self):
+        """ Serializes static layers of the loaded map in default encoding, if they are not serialized yet.
+        """
+        for layer in self.STATIC_LAYERS:
+            self.serialize_layer(layer)
+
+    def serialize_layer_attributes(self, layer, encoding):
+        return self.serialize(encoding, attributes=self.LAYER_ATTRIBUTES.get(layer, {}))
+
+    def layer_to_dict(self, layer):
+        return self.default_serializer(self, attributes=self.LAYER_ATTRIBUTES.get(layer, {}))
+
     def layer_to_json_str(self, layer):
-        attributes = {}
-        if layer == 0:
-            attributes = {'idx', 'name', 'points', 'lines'}
-        elif layer == 1:
-            attributes = {'idx', 'posts', 'trains', 'ratings'}
-        elif layer == 10:
-            attributes = {'idx', 'size', 'coordinates'}
-        return self.to_json_str(attributes=attributes)
+        return self.serialize_layer_attributes(layer, Encoding.JSON)
 
     def __repr__(self):
         return '<Map(idx={}, name={}, lines_idx=[{}], points_idx=[{}], posts_idx=[{}], trains_idx=[{}])>'.format(
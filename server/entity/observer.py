@@ -4,11 +4,11 @@
 import errors
 from config import CONFIG
 from db import game_db, map_db
-from defs import Action, Result
+from defs import Action, Encoding, Result
 from entity.event import EventType
 from entity.game import Game
 from entity.player import Player
-from entity.serializable import Serializable
+from entity.serializable import Message
 from logger import log
 
 
@@ -23,7 +23,9 @@ def game_required(func):
 
 class Observer(object):
 
-    def __init__(self):
+    def __init__(self, encoding=Encoding.JSON, compression=False):
+        self.encoding = encoding
+        self.compression = compression
         self.game = None
         self.actions = []
         self.players = {}
@@ -45,7 +47,7 @@ class Observer(object):
         else:
             return True
 
-    def games_to_json_str(self):
+    def serialize_games(self):
         """ Retrieves list of games.
         """
         games_list = []
@@ -61,9 +63,9 @@ class Observer(object):
             }
             games_list.append(game)
 
-        games = Serializable()
+        games = Message()
         games.set_attributes(games=games_list)
-        return games.to_json_str()
+        return games.serialize(self.encoding)
 
     def reset_game(self):
         """ Resets the game to initial state.
@@ -93,7 +95,9 @@ class Observer(object):
         """ Returns specified game map layer.
         """
         self.check_keys(data, ['layer'])
-        message = self.game.get_map_layer(None, data['layer'])
+        message = self.game.get_map_layer(
+            None, data['layer'], self.encoding, self.compression, since_tick=data.get('since_tick', None)
+        )
         return Result.OKEY, message
 
     def game_turn(self, turns):
@@ -119,15 +123,12 @@ class Observer(object):
                 self.players[player_idx] = player
                 self.game.add_player(player)
 
-            elif code == Action.MOVE:
-                self.game.move_train(
-                    player, message['train_idx'], message['speed'], message['line_idx']
-                )
+            elif code in (Action.MOVE, Action.UPGRADE):
+                self.player_action(player, code, message)
 
-            elif code == Action.UPGRADE:
-                self.game.make_upgrade(
-                    player, posts_idx=message.get('posts', []), trains_idx=message.get('trains', [])
-                )
+            elif code == Action.BATCH:
+                for item in message['actions']:
+                    self.player_action(player, item['action'], item['data'])
 
             elif code == Action.TURN:
                 self.game.tick()
@@ -147,6 +148,18 @@ class Observer(object):
             if sub_turn >= turns:
                 break
 
+    def player_action(self, player, code, message):
+        """ Plays player's action MOVE or UPGRADE.
+        """
+        if code == Action.MOVE:
+            self.game.move_train(
+                player, message['train_idx'], message['speed'], message['line_idx']
+            )
+        elif code == Action.UPGRADE:
+            self.game.make_upgrade(
+                player, posts_idx=message.get('posts', []), trains_idx=message.get('trains', [])
+            )
+
     @game_required
     def on_turn(self, data):
         """ Sets specified game turn.
@@ -198,7 +211,7 @@ class Observer(object):
     def on_observer(self, _):
         """ Returns list of games.
         """
-        message = self.games_to_json_str()
+        message = self.serialize_games()
         return Result.OKEY, message
 
     ACTION_MAP = {
@@ -13,9 +13,13 @@ from entity.train import Train
 
 class Player(Serializable):
 
-    PROTECTED = {'password', 'turn_called', 'db', 'lock', }
+    PROTECTED = {'password', 'turn_called', 'db', 'lock', 'resume_token', }
     DICT_TO_LIST = {'trains', }
 
+    __slots__ = (
+        'idx', 'name', 'password', 'trains', 'home', 'town', 'turn_called', 'in_game', 'rating', 'resume_token', 'lock',
+    )
+
     def __init__(self, name, password=None, idx=None):
         self.idx = str(uuid.uuid4()) if idx is None else idx
         self.name = name
@@ -26,6 +30,7 @@ class Player(Serializable):
         self.turn_called = False
         self.in_game = False
         self.rating = 0
+        self.resume_token = None  # Allows the player to return to the game without LOGIN, see Game.resume_player.
         self.lock = Lock()
 
     def __eq__(self, other):
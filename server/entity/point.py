@@ -8,6 +8,9 @@ class Point(Serializable):
     unique id (idx) - index of the point
     post_idx (may be empty) - index of post, defined if a post is associated with the point
     """
+
+    __slots__ = ('idx', 'post_idx', )
+
     def __init__(self, idx, post_idx=None):
         self.idx = idx
         self.post_idx = post_idx
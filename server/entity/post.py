@@ -18,6 +18,7 @@ class PostType(IntEnum):
 class Post(Serializable):
     """ Post object represents dynamic object on the map.
     Describes additional parameters of the Point. Post can belong to only one Point.
+    Post(...) creates an instance of the class of the post's type: Town, Market or Storage.
 
     Initialization:
         idx: unique index of the Post
@@ -51,6 +52,15 @@ class Post(Serializable):
 
     PROTECTED = CONFIG.POST_HIDDEN_FIELDS
 
+    # Fields of all types, each type declares its own fields, so all fields of a post are set:
+    __slots__ = ('idx', 'name', 'type', 'point_idx', 'events')
+
+    def __new__(cls, idx, name, post_type, *args, **kwargs):
+        # The post is created as an instance of its type's class:
+        if cls is Post:
+            cls = POST_CLASSES[PostType(post_type)]
+        return super(Post, cls).__new__(cls)
+
     def __init__(self, idx, name, post_type, population=0, armor=0, product=0,
                  replenishment=1, point_idx=None, player_idx=None, level=1):
         self.idx = idx
@@ -59,38 +69,76 @@ class Post(Serializable):
         self.point_idx = point_idx
         self.events = []
 
-        if self.type == PostType.TOWN:
-            self.level = level
-            self.population = population
-            self.product = product
-            self.armor = armor
-            self.player_idx = player_idx
-            # Level-related attributes:
-            self.population_capacity = 0
-            self.product_capacity = 0
-            self.armor_capacity = 0
-            self.train_cooldown = 0
-            self.next_level_price = 0
-            # Set level-related attributes from levels config:
-            for key, value in CONFIG.TOWN_LEVELS[self.level].items():
-                setattr(self, key, value)
-
-        if self.type == PostType.MARKET:
-            self.product_capacity = product
-            self.product = product
-            self.replenishment = replenishment
-
-        if self.type == PostType.STORAGE:
-            self.armor_capacity = armor
-            self.armor = armor
-            self.replenishment = replenishment
+    def __repr__(self):
+        return '<Post(idx={}, name=\'{}\', type={!r}, point_idx={})>'.format(
+            self.idx, self.name, self.type, self.point_idx
+        )
+
+
+class Town(Post):
+    """ Post of type TOWN.
+    """
+
+    # Level-related attributes of Town for each level:
+    LEVELS = {level: tuple(attributes.items()) for level, attributes in CONFIG.TOWN_LEVELS.items()}
+
+    __slots__ = (
+        'level', 'population', 'product', 'armor', 'player_idx', 'population_capacity', 'product_capacity',
+        'armor_capacity', 'train_cooldown', 'next_level_price',
+    )
+
+    def __init__(self, idx, name, post_type, population=0, armor=0, product=0,
+                 replenishment=1, point_idx=None, player_idx=None, level=1):
+        super(Town, self).__init__(idx, name, post_type, point_idx=point_idx)
+        self.population = population
+        self.product = product
+        self.armor = armor
+        self.player_idx = player_idx
+        # Level-related attributes:
+        self.population_capacity = 0
+        self.product_capacity = 0
+        self.armor_capacity = 0
+        self.train_cooldown = 0
+        self.next_level_price = 0
+        # Set level and level-related attributes from levels config:
+        self.set_level(level)
 
     def set_level(self, next_lvl):
         self.level = next_lvl
-        for key, value in CONFIG.TOWN_LEVELS[self.level].items():
+        for key, value in self.LEVELS[self.level]:
             setattr(self, key, value)
 
-    def __repr__(self):
-        return '<Post(idx={}, name=\'{}\', type={!r}, point_idx={})>'.format(
-            self.idx, self.name, self.type, self.point_idx
-        )
+
+class Market(Post):
+    """ Post of type MARKET.
+    """
+
+    __slots__ = ('product', 'product_capacity', 'replenishment')
+
+    def __init__(self, idx, name, post_type, population=0, armor=0, product=0,
+                 replenishment=1, point_idx=None, player_idx=None, level=1):
+        super(Market, self).__init__(idx, name, post_type, point_idx=point_idx)
+        self.product_capacity = product
+        self.product = product
+        self.replenishment = replenishment
+
+
+class Storage(Post):
+    """ Post of type STORAGE.
+    """
+
+    __slots__ = ('armor', 'armor_capacity', 'replenishment')
+
+    def __init__(self, idx, name, post_type, population=0, armor=0, product=0,
+                 replenishment=1, point_idx=None, player_idx=None, level=1):
+        super(Storage, self).__init__(idx, name, post_type, point_idx=point_idx)
+        self.armor_capacity = armor
+        self.armor = armor
+        self.replenishment = replenishment
+
+
+POST_CLASSES = {
+    PostType.TOWN: Town,
+    PostType.MARKET: Market,
+    PostType.STORAGE: Storage,
+}
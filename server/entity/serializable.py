@@ -1,9 +1,123 @@
 """ JSON serialization helper.
 """
 import json
+import operator
+
+try:
+    import msgpack
+except ImportError:  # Optional dependency, needed for MSGPACK encoding only.
+    msgpack = None
+
+from defs import Encoding
+
+# Compiled encoders of objects to dictionaries, key: class of objects, attributes to encode:
+ENCODERS = {}
+# Compiled encoders of all not protected attributes, key: class of objects:
+OBJECT_ENCODERS = {}
+
+
+def get_fields(cls):
+    """ Returns fields declared in __slots__ of the class and its bases.
+    """
+    fields = []
+    for base in reversed(cls.__mro__):
+        slots = base.__dict__.get('__slots__', ())
+        fields.extend([slots] if isinstance(slots, str) else slots)
+    return tuple(field for field in fields if field not in ('__dict__', '__weakref__'))
+
+
+def compile_fields_encoder(fields):
+    """ Compiles encoder of objects with fields declared in __slots__ to a function building the dictionary
+    of the fields by one expression. All fields of the objects have to be set.
+    The dictionary display is faster than building the dictionary from the tuple of fields fetched by
+    operator.attrgetter, see tests/serialization_benchmark.py.
+    """
+    source = (
+        'def encode_fields(obj):\n'
+        '    return {{{}}}\n'
+    ).format(', '.join('{!r}: obj.{}'.format(field, field) for field in fields))
+    namespace = {}
+    exec(source, namespace)
+    return namespace['encode_fields']
+
+
+def compile_encoder(cls, attributes=None):
+    """ Compiles encoder of the class's objects to dictionaries of given attributes (all not protected ones if None).
+    The set of encoded attributes is computed once, the encoder does only the work needed for the class:
+    objects with fields declared in __slots__ are encoded by one expression fetching all fields, objects without
+    PROTECTED and DICT_TO_LIST attributes are encoded by their __dict__ as is.
+    """
+    protected = frozenset(getattr(cls, 'PROTECTED', ()))
+    dict_to_list = tuple(getattr(cls, 'DICT_TO_LIST', ()))
+    if not cls.__dictoffset__:
+        fields = tuple(
+            field for field in get_fields(cls) if field not in protected and (not attributes or field in attributes)
+        )
+        dict_to_list = tuple(attr for attr in dict_to_list if attr in fields)
+        select = compile_fields_encoder(fields)
+    elif attributes:
+        allowed = frozenset(attributes) - protected
+        dict_to_list = tuple(attr for attr in dict_to_list if attr in allowed)
+
+        def select(obj):
+            return {attr: value for attr, value in obj.__dict__.items() if attr in allowed}
+    elif protected:
+        def select(obj):
+            obj_dict = obj.__dict__.copy()
+            for attr in protected:
+                obj_dict.pop(attr, None)
+            return obj_dict
+    elif dict_to_list:
+        def select(obj):
+            return obj.__dict__.copy()
+    else:
+        return operator.attrgetter('__dict__')
+
+    if not dict_to_list:
+        return select
+
+    def encode(obj):
+        obj_dict = select(obj)
+        for attr in dict_to_list:
+            if attr in obj_dict:
+                obj_dict[attr] = list(obj_dict[attr].values())
+        return obj_dict
+
+    return encode
+
+
+def get_encoder(cls, attributes=None):
+    """ Returns encoder of the class's objects compiled for given attributes, see compile_encoder.
+    """
+    if not attributes:
+        encoder = OBJECT_ENCODERS.get(cls, None)
+        if encoder is None:
+            encoder = OBJECT_ENCODERS.setdefault(cls, compile_encoder(cls))
+        return encoder
+    key = (cls, frozenset(attributes))
+    encoder = ENCODERS.get(key, None)
+    if encoder is None:
+        encoder = ENCODERS.setdefault(key, compile_encoder(cls, attributes))
+    return encoder
+
+
+def encode_object(obj):
+    """ Encodes nested object for json and msgpack encoders (their 'default' hook).
+    Returned dictionary can be the object's __dict__ itself, so it must not be changed.
+    """
+    encoder = OBJECT_ENCODERS.get(type(obj), None)
+    if encoder is None:
+        encoder = get_encoder(type(obj))
+    return encoder(obj)
 
 
 class Serializable(object):
+    """ Base class of serializable objects. Game entities declare their fields in __slots__ and have no __dict__,
+    all fields of an entity are set on its initialization. Subclasses without __slots__ keep any attributes
+    in __dict__.
+    """
+
+    __slots__ = ()
 
     def set_attributes(self, **kwargs):
         for attr, value in kwargs.items():
@@ -11,33 +125,47 @@ class Serializable(object):
 
     def __repr__(self):
         return json.dumps(
-            self.__dict__,
-            default=self.default_serializer
+            self.default_serializer(self),
+            default=encode_object
         )
 
     @staticmethod
     def default_serializer(obj, attributes=None):
-        obj_dict = obj.__dict__.copy()
-
-        if hasattr(obj, 'PROTECTED'):
-            for attr in obj.PROTECTED:
-                obj_dict.pop(attr, None)
-
-        if attributes:
-            for attr in list(obj_dict.keys()):
-                if attr not in attributes:
-                    obj_dict.pop(attr, None)
+        """ Returns dictionary of the object's attributes without PROTECTED ones, dictionaries listed in DICT_TO_LIST
+        are converted to lists of their values. Nested objects are encoded by the same way.
+        """
+        obj_dict = get_encoder(type(obj), attributes)(obj)
+        # The dictionary can be changed by the caller:
+        return obj_dict.copy() if obj_dict is getattr(obj, '__dict__', None) else obj_dict
 
-        if hasattr(obj, 'DICT_TO_LIST'):
-            for attr in obj.DICT_TO_LIST:
-                if attr in obj_dict:
-                    obj_dict[attr] = list(obj_dict[attr].values())
-
-        return obj_dict
+    @staticmethod
+    def is_encoding_available(encoding):
+        return encoding in Encoding.__members__.values() and (encoding != Encoding.MSGPACK or msgpack is not None)
 
-    def to_json_str(self, attributes=None):
+    def serialize(self, encoding=Encoding.JSON, attributes=None, extra_attributes=None):
+        """ Serializes the object to given wire encoding, extra attributes are added to the object's ones.
+        returns: string for JSON encodings, bytes for binary encodings
+        """
         obj_dict = self.default_serializer(self, attributes=attributes)
+        if extra_attributes:
+            obj_dict.update(extra_attributes)
+        if encoding == Encoding.COMPACT_JSON:
+            return json.dumps(
+                obj_dict, separators=(',', ':'),
+                default=encode_object
+            )
+        elif encoding == Encoding.MSGPACK:
+            return msgpack.packb(obj_dict, default=encode_object)
         return json.dumps(
             obj_dict, sort_keys=True, indent=4,
-            default=self.default_serializer
+            default=encode_object
         )
+
+    def to_json_str(self, attributes=None):
+        return self.serialize(Encoding.JSON, attributes=attributes)
+
+
+class Message(Serializable):
+    """ Serializable object with arbitrary attributes, like a response message.
+    """
+    pass
@@ -36,6 +36,13 @@ class Train(Serializable):
     """
 
     PROTECTED = CONFIG.TRAIN_HIDDEN_FIELDS
+    # Level-related attributes for each level:
+    LEVELS = {level: tuple(attributes.items()) for level, attributes in CONFIG.TRAIN_LEVELS.items()}
+
+    __slots__ = (
+        'idx', 'line_idx', 'position', 'speed', 'player_idx', 'level', 'goods_capacity', 'fuel_capacity',
+        'fuel_consumption', 'next_level_price', 'fuel', 'goods', 'goods_type', 'events', 'cooldown',
+    )
 
     def __init__(self, idx, line_idx=None, position=None, speed=0, player_idx=None, level=1, goods=0, goods_type=None):
         self.idx = idx
@@ -43,15 +50,13 @@ class Train(Serializable):
         self.position = position
         self.speed = speed
         self.player_idx = player_idx
-        self.level = level
         # Level-related attributes:
         self.goods_capacity = 0
         self.fuel_capacity = 0
         self.fuel_consumption = 0
         self.next_level_price = 0
-        # Set level-related attributes from levels config:
-        for key, value in CONFIG.TRAIN_LEVELS[self.level].items():
-            setattr(self, key, value)
+        # Set level and level-related attributes from levels config:
+        self.set_level(level)
         self.fuel = self.fuel_capacity
         self.goods = goods
         self.goods_type = goods_type
@@ -60,7 +65,7 @@ class Train(Serializable):
 
     def set_level(self, next_lvl):
         self.level = next_lvl
-        for key, value in CONFIG.TRAIN_LEVELS[self.level].items():
+        for key, value in self.LEVELS[self.level]:
             setattr(self, key, value)
 
     def __repr__(self):
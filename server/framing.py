@@ -0,0 +1,217 @@
+""" Framing of client commands.
+"""
+import codecs
+
+import errors
+from config import CONFIG
+from defs import Action, ActionFlag
+
+
+class FrameReader(object):
+    """ Incremental parser of client commands (frames: action, request id if the action has REQUEST_ID flag,
+    session id if the action has SESSION_ID flag, size of message, message).
+
+    Data is received directly into the reader's buffer (see get_buffer), headers and messages are parsed
+    from the buffer without intermediate copies, message is decoded only when it is received completely.
+    The buffer grows to fit the whole frame being received. Messages larger than STREAMING_DECODE_THRESHOLD
+    are decoded chunk by chunk while they are received, so the buffer does not grow for them. Frames larger
+    than MAX_FRAME_SIZE are rejected as soon as their header is received, their messages are skipped.
+    """
+
+    HEADER_SIZE = CONFIG.ACTION_HEADER + CONFIG.MSGLEN_HEADER
+
+    def __init__(self, chunk_size=CONFIG.RECEIVE_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.buffer = bytearray(chunk_size)
+        self.start = 0  # Beginning of not parsed data.
+        self.end = 0  # End of received data.
+        self.large_frame = None  # LargeFrame which message is being received.
+
+    def __len__(self):
+        return self.end - self.start
+
+    @property
+    def receiving(self):
+        """ True if a frame is received partially.
+        """
+        return bool(len(self)) or self.large_frame is not None
+
+    def get_action(self):
+        """ Returns action code with flags of the frame being received or None if it is not received yet.
+        """
+        if len(self) < CONFIG.ACTION_HEADER:
+            return None
+        with memoryview(self.buffer) as view:
+            return int.from_bytes(view[self.start:self.start + CONFIG.ACTION_HEADER], byteorder='little')
+
+    def get_header_size(self):
+        """ Returns size of the header of the frame being received or None if the action code is not received yet.
+        """
+        action = self.get_action()
+        if action is None:
+            return None
+        header_size = self.HEADER_SIZE
+        if action & ActionFlag.REQUEST_ID:
+            header_size += CONFIG.REQUEST_ID_HEADER
+        if action & ActionFlag.SESSION_ID:
+            header_size += CONFIG.SESSION_ID_HEADER
+        return header_size
+
+    def get_frame_size(self):
+        """ Returns size of the frame being received or None if the frame's header is not received yet.
+        """
+        header_size = self.get_header_size()
+        if header_size is None or len(self) < header_size:
+            return None
+        msglen_start = self.start + header_size - CONFIG.MSGLEN_HEADER
+        with memoryview(self.buffer) as view:
+            message_len = int.from_bytes(view[msglen_start:msglen_start + CONFIG.MSGLEN_HEADER], byteorder='little')
+        return header_size + message_len
+
+    def get_buffer(self):
+        """ Returns writable memory to receive data into. Size of the memory is at least one chunk,
+        it grows up to the rest of the current frame for large frames.
+        """
+        size = self.chunk_size
+        frame_size = self.get_frame_size() if self.large_frame is None else None
+        if frame_size is not None:
+            # Grow geometrically, so memory is allocated only for really received data:
+            size = max(size, min(frame_size - len(self), len(self.buffer)))
+        if len(self.buffer) - self.end < size:
+            # Move not parsed data to the beginning of the buffer:
+            if self.start:
+                self.buffer[:len(self)] = self.buffer[self.start:self.end]
+                self.start, self.end = 0, len(self)
+            if len(self.buffer) - self.end < size:
+                self.buffer.extend(bytes(size - (len(self.buffer) - self.end)))
+        return memoryview(self.buffer)[self.end:]
+
+    def buffer_updated(self, nbytes):
+        """ Marks received data, which was written into the buffer.
+        """
+        self.end += nbytes
+
+    def feed(self, data):
+        """ Copies received data into the buffer.
+        """
+        while data:
+            with self.get_buffer() as buffer:
+                nbytes = min(len(buffer), len(data))
+                buffer[:nbytes] = data[:nbytes]
+            self.buffer_updated(nbytes)
+            data = data[nbytes:]
+
+    def read_ids(self, action):
+        """ Returns request id and session id of the frame being received (ids are None if they are not sent).
+        """
+        request_id = session_id = None
+        id_start = self.start + CONFIG.ACTION_HEADER
+        with memoryview(self.buffer) as view:
+            if action & ActionFlag.REQUEST_ID:
+                request_id = int.from_bytes(view[id_start:id_start + CONFIG.REQUEST_ID_HEADER], byteorder='little')
+                id_start += CONFIG.REQUEST_ID_HEADER
+            if action & ActionFlag.SESSION_ID:
+                session_id = int.from_bytes(view[id_start:id_start + CONFIG.SESSION_ID_HEADER], byteorder='little')
+        return request_id, session_id
+
+    def read_frame(self):
+        """ Parses next frame.
+        returns: action, message, request id and session id (ids are None if they are not sent),
+            or None if the frame is not received completely;
+            message is None if the frame is rejected because of its size
+        """
+        if self.large_frame is not None:
+            return self.read_large_frame()
+
+        frame_size = self.get_frame_size()
+        if frame_size is None:
+            return None
+        action = self.get_action()
+        header_size = self.get_header_size()
+        message_len = frame_size - header_size
+        if message_len > CONFIG.STREAMING_DECODE_THRESHOLD or frame_size > CONFIG.MAX_FRAME_SIZE:
+            self.large_frame = LargeFrame(
+                Action(action & CONFIG.CODE_MASK), *self.read_ids(action), message_len,
+                rejected=frame_size > CONFIG.MAX_FRAME_SIZE
+            )
+            self.start += header_size
+            if self.large_frame.rejected:
+                # The frame is reported at once, its message is skipped while it is received:
+                return self.large_frame.get_frame()
+            return self.read_large_frame()
+        if len(self) < frame_size:
+            return None
+
+        request_id, session_id = self.read_ids(action)
+        with memoryview(self.buffer) as view:
+            message = str(view[self.start + header_size:self.start + frame_size], 'utf-8') or '{}'
+        self.start += frame_size
+        self.reset_if_parsed()
+
+        return Action(action & CONFIG.CODE_MASK), message, request_id, session_id
+
+    def read_large_frame(self):
+        """ Decodes (or skips if the frame is rejected) received part of the large frame's message.
+        returns: the same as read_frame
+        """
+        frame = self.large_frame
+        nbytes = min(len(self), frame.remaining)
+        if not frame.rejected:
+            with memoryview(self.buffer) as view:
+                frame.decode(view[self.start:self.start + nbytes])
+        self.start += nbytes
+        frame.remaining -= nbytes
+        self.reset_if_parsed()
+        if frame.remaining:
+            return None
+
+        self.large_frame = None
+        if frame.rejected:
+            # The frame is already reported, the next one can be received:
+            return self.read_frame()
+        return frame.get_frame()
+
+    def reset_if_parsed(self):
+        """ Reuses the buffer from the beginning if all received data is parsed.
+        """
+        if self.start == self.end:
+            self.start = self.end = 0
+            if len(self.buffer) > self.chunk_size:
+                self.buffer = bytearray(self.chunk_size)
+
+    def take_data(self):
+        """ Returns not parsed data and clears the buffer.
+        """
+        if self.large_frame is not None:
+            raise errors.BadCommand('The connection can\'t be passed while a large command is received')
+        data = bytes(self.buffer[self.start:self.end])
+        self.start = self.end = 0
+        return data
+
+
+class LargeFrame(object):
+    """ Frame which message is decoded incrementally while it is received.
+    """
+
+    def __init__(self, action, request_id, session_id, message_len, rejected=False):
+        self.action = action
+        self.request_id = request_id
+        self.session_id = session_id
+        self.remaining = message_len
+        self.rejected = rejected
+        self.decoder = None if rejected else codecs.getincrementaldecoder('utf-8')()
+        self.parts = []
+
+    def decode(self, data):
+        self.parts.append(self.decoder.decode(data))
+
+    def get_frame(self):
+        """ Returns the frame in the same form as FrameReader.read_frame, message is None for rejected frame.
+        """
+        if self.rejected:
+            message = None
+        else:
+            self.parts.append(self.decoder.decode(b'', final=True))
+            message = ''.join(self.parts) or '{}'
+            self.parts = []
+        return self.action, message, self.request_id, self.session_id
@@ -0,0 +1,34 @@
+""" Server metrics.
+"""
+from collections import Counter
+from threading import Lock
+
+
+class Metrics(object):
+    """ Process-wide counters of server events.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._counters = Counter()
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def pop(self, name):
+        """ Removes the counter, if any.
+        """
+        with self._lock:
+            self._counters.pop(name, None)
+
+    def get(self, name):
+        with self._lock:
+            return self._counters[name]
+
+    def to_dict(self):
+        with self._lock:
+            return dict(self._counters)
+
+
+metrics = Metrics()
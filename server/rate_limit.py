@@ -0,0 +1,46 @@
+""" Rate limiting of client commands.
+"""
+import time
+
+from config import CONFIG
+
+
+class TokenBucket(object):
+    """ Allows commands at given average rate (commands per second) with bursts up to given size.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def consume(self, now):
+        """ Takes one token from the bucket.
+        returns: False if the bucket is empty
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class RateLimiter(object):
+    """ Rate limits of the connection: for all commands and for particular actions.
+    Not thread safe, commands of the connection are executed one by one.
+    """
+
+    def __init__(self, rate_limit=CONFIG.RATE_LIMIT, action_rate_limits=CONFIG.ACTION_RATE_LIMITS):
+        self.bucket = None if rate_limit is None else TokenBucket(*rate_limit)
+        self.action_buckets = {action: TokenBucket(*limit) for action, limit in action_rate_limits.items()}
+
+    def acquire(self, action):
+        """ Returns True if the command is allowed.
+        """
+        now = time.monotonic()
+        action_bucket = self.action_buckets.get(action, None)
+        if action_bucket is not None and not action_bucket.consume(now):
+            return False
+        return self.bucket is None or self.bucket.consume(now)
@@ -1,21 +1,40 @@
 """ Game server.
 """
+import asyncio
+import itertools
 import json
+import logging
+import multiprocessing
+import os
+import selectors
+import signal
 import socket
+import subprocess
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from functools import wraps
-from socketserver import ThreadingTCPServer, BaseRequestHandler
+from socketserver import ThreadingTCPServer, ThreadingUnixStreamServer, BaseRequestHandler
+from queue import Queue, Empty
+from threading import Event, RLock, Thread
 
 from invoke import task
 
 import errors
+from cluster import Cluster
+from compression import CompressedMessage, compress
 from config import CONFIG
 from db import game_db
-from defs import Action, Result
+from defs import Action, ActionFlag, Encoding, Result, ResultFlag
 from entity.game import Game, GameState
 from entity.observer import Observer
 from entity.player import Player
-from entity.serializable import Serializable
+from entity.serializable import Message, Serializable
+from framing import FrameReader
 from logger import log
+from metrics import metrics
+from rate_limit import RateLimiter
 
 
 def login_required(func):
@@ -28,142 +47,419 @@ def login_required(func):
     return wrapped
 
 
-class GameServerRequestHandler(BaseRequestHandler):
+def payload_check(**key_types):
+    """ Compiles check of the command's payload for frequent actions: all keys are present and their values
+    have exactly expected types (so bool is not accepted as int). The payload is checked in one pass.
+    """
+    expected = tuple(key_types.items())
+    missing_keys_error = (
+        'The command\'s payload does not contain all needed keys, '
+        'following keys are expected: {}'.format(list(key_types))
+    )
+
+    def check(data: dict):
+        for key, value_type in expected:
+            try:
+                value = data[key]
+            except KeyError:
+                raise errors.BadCommand(missing_keys_error) from None
+            if type(value) is not value_type:
+                raise errors.BadCommand('The command\'s payload key \'{}\' is not {}'.format(key, value_type.__name__))
+
+    return check
+
+
+check_move_payload = payload_check(train_idx=int, speed=int, line_idx=int)
+
+
+class ConnectionTransport(object):
+    """ Sending of the data and closing of the client connection, implemented by particular server engine.
+    Player sessions use the transport of their connection.
+    """
+
+    def send(self, *data: bytes):
+        """ Sends data to the client, all chunks of the data are sent at once.
+        """
+        raise NotImplementedError
+
+    def close_connection(self):
+        """ Closes connection with the client.
+        """
+        raise NotImplementedError
+
+    def abort_connection(self):
+        """ Closes connection with the client without sending of buffered data.
+        """
+        raise NotImplementedError
+
+    def detach_socket(self):
+        """ Stops serving of the connection without closing it.
+        returns: duplicated socket's file descriptor
+        """
+        raise NotImplementedError
+
+
+class GameServerProtocol(object):
+    """ Transport independent part of the game server: parses client commands, executes actions and writes responses.
+    Connection handlers of server engines also implement ConnectionTransport.
+    """
 
     HANDLERS = {}
+    DRAINING = False  # New games are not accepted, the server is stopped after running games.
+    # Games which are still running on the previous server process after restart, they can't be joined:
+    DRAINED_GAMES = frozenset()
+    DRAINED_GAMES_DEADLINE = 0
 
-    def __init__(self, *args, **kwargs):
-        self.action = None
-        self.message_len = None
-        self.message = None
-        self.data = None
+    def init_session(self):
         self.player = None
         self.game = None
         self.game_idx = None
         self.observer = None
+        self.encoding = Encoding.JSON
+        self.compression = False
         self.closed = None
-        super(GameServerRequestHandler, self).__init__(*args, **kwargs)
+        self.request_id = None
+        self.session_id = None
+        self.subscription_layer = None
+        self.hand_off_worker = None
+        self.hand_off_data = None
+        self.throttled = 0  # Number of throttled commands since the last allowed one.
 
-    def setup(self):
+    def init_connection(self):
+        self.init_session()
+        self.reader = FrameReader()
+        self.sessions = {}
+        self.rate_limiter = RateLimiter()
+        self.output = []
+        self.output_corked = False
+        self.output_lock = RLock()
+        self.last_activity = time.monotonic()
+        self.frame_started_at = None  # Time when receiving of not completed command was started.
+        self.output_blocked_since = None  # Time since output can't be sent.
+
+    @staticmethod
+    def is_connections_limit_reached():
+        return len(GameServerProtocol.HANDLERS) >= CONFIG.MAX_CONNECTIONS
+
+    @staticmethod
+    def reject_connection(client_address):
+        log.warn('Connection from {} rejected, connections limit reached: {}'.format(
+            client_address, CONFIG.MAX_CONNECTIONS))
+        metrics.inc('connections_rejected')
+
+    def drop_slow_consumer(self):
+        """ Closes connection of the client which does not read responses.
+        """
+        log.warn('Connection from {} closed, the client does not read responses'.format(
+            self.client_address), game=self.game)
+        metrics.inc('slow_consumers_disconnected')
+        self.closed = True
+        self.abort_connection()
+
+    def get_timeout(self, now):
+        """ Returns name of expired timeout of the connection or None.
+        """
+        if self.output_blocked_since is not None and now - self.output_blocked_since > CONFIG.WRITE_TIMEOUT:
+            return 'write timeout'
+        if self.frame_started_at is not None and now - self.frame_started_at > CONFIG.READ_TIMEOUT:
+            return 'read timeout'
+        if now - self.last_activity > CONFIG.IDLE_TIMEOUT:
+            return 'idle timeout'
+        return None
+
+    @staticmethod
+    def reap_dead_connections():
+        """ Closes connections with expired timeouts, the connections are finished as usual.
+        """
+        now = time.monotonic()
+        for handler in list(GameServerProtocol.HANDLERS.values()):
+            timeout = handler.get_timeout(now)
+            if timeout is not None and not handler.closed:
+                log.warn('Connection from {} closed by {}'.format(handler.client_address, timeout), game=handler.game)
+                metrics.inc('connections_reaped')
+                handler.closed = True
+                handler.abort_connection()
+
+    def connection_opened(self):
         log.info('New connection from {}'.format(self.client_address), game=self.game)
         self.closed = False
         self.HANDLERS[id(self)] = self
 
-    def handle(self):
-        while not self.closed:
-            data = self.request.recv(CONFIG.RECEIVE_CHUNK_SIZE)
-            if data:
-                self.data_received(data)
-            else:
-                self.closed = True
-
-    @staticmethod
-    def shutdown_all_sockets():
-        for handler in GameServerRequestHandler.HANDLERS.values():
-            handler.request.shutdown(socket.SHUT_RDWR)
+    def connection_closed(self):
+        if self.hand_off_worker is not None:
+            log.info('Connection from {} handed off to worker {}'.format(
+                self.client_address, self.hand_off_worker))
+        else:
+            log.warn('Connection from {} lost'.format(self.client_address), game=self.game)
+        self.leave_game()
+        for session in self.sessions.values():
+            session.leave_game()
+        self.HANDLERS.pop(id(self))
 
-    def finish(self):
-        log.warn('Connection from {} lost'.format(self.client_address), game=self.game)
+    def leave_game(self):
+        """ Removes the player from the game if the connection is lost without LOGOUT.
+        """
+        if self.game is not None:
+            self.game.unsubscribe(self.on_tick_notification)
         if self.game is not None and self.player is not None and self.player.in_game:
+            self.drop_player_metrics()
             self.game.remove_player(self.player)
             if not self.observer:
                 game_db.add_action(self.game_idx, Action.LOGOUT, player_idx=self.player.idx)
-        self.HANDLERS.pop(id(self))
+
+    def take_received_data(self):
+        """ Returns received but not processed data.
+        """
+        return self.reader.take_data()
+
+    def hand_off(self):
+        """ Passes the connection to the server process which owns requested game.
+        """
+        self.flush()
+        try:
+            data = self.hand_off_data + self.take_received_data()
+        except errors.BadCommand as err:
+            self.error_response(Result.BAD_COMMAND, err)
+            self.closed = True
+            return
+        fd = self.detach_socket()
+        try:
+            Game.CLUSTER.hand_off(self.hand_off_worker, fd, self.client_address, data)
+        except Exception:
+            log.exception('Unable to hand off connection from {}'.format(self.client_address))
+        finally:
+            os.close(fd)
+            self.closed = True
+
+    @staticmethod
+    def encode_request(action, message, request_id=None, session_id=None):
+        message = message.encode('utf-8')
+        flags = ActionFlag(0)
+        ids = b''
+        if request_id is not None:
+            flags |= ActionFlag.REQUEST_ID
+            ids += request_id.to_bytes(CONFIG.REQUEST_ID_HEADER, byteorder='little')
+        if session_id is not None:
+            flags |= ActionFlag.SESSION_ID
+            ids += session_id.to_bytes(CONFIG.SESSION_ID_HEADER, byteorder='little')
+        return (
+            (action | flags).to_bytes(CONFIG.ACTION_HEADER, byteorder='little') + ids +
+            len(message).to_bytes(CONFIG.MSGLEN_HEADER, byteorder='little') + message
+        )
+
+    @staticmethod
+    def shutdown_all_sockets():
+        for handler in list(GameServerProtocol.HANDLERS.values()):
+            handler.close_connection()
+
+    def get_buffer(self, sizehint=-1):
+        """ Returns buffer to receive data into.
+        """
+        return self.reader.get_buffer()
+
+    def buffer_updated(self, nbytes):
+        """ Handles data received into the buffer.
+        """
+        self.reader.buffer_updated(nbytes)
+        self.frames_received()
 
     def data_received(self, data):
-        if self.data:
-            data = self.data + data
-            self.data = None
+        self.reader.feed(data)
+        self.frames_received()
+
+    def update_receiving_time(self, frame_completed):
+        self.last_activity = time.monotonic()
+        if not self.reader.receiving:
+            self.frame_started_at = None
+        elif frame_completed or self.frame_started_at is None:
+            self.frame_started_at = self.last_activity
+
+    def frames_received(self):
+        """ Handles all completely received commands in order of receiving (commands pipelining).
+        Responses on the commands are sent at once.
+        """
+        output_corked, self.output_corked = self.output_corked, True
+        frame_completed = False
+        try:
+            while not self.closed and self.hand_off_worker is None:
+                frame = self.reader.read_frame()
+                if frame is None:
+                    break
+                frame_completed = True
+                self.request_received(*frame)
+        finally:
+            self.output_corked = output_corked
+            if not output_corked:
+                self.flush()
+            self.update_receiving_time(frame_completed)
 
-        if self.parse_data(data):
-            log.info('[REQUEST] Player: {}, action: {!r}, message:\n{}'.format(
+    def request_received(self, action, message, request_id=None, session_id=None):
+        """ Handles parsed command.
+        """
+        self.process_request(action, message, request_id, session_id)
+
+    def process_request(self, action, message, request_id=None, session_id=None):
+        """ Executes parsed command and writes response.
+        If the command has request id, the response has the same id and can be written out of order.
+        If the command has session id, it is executed by the connection's session with this id.
+        """
+        if message is None:
+            self.request_rejected(action, request_id, session_id)
+            return
+        if session_id is not None:
+            self.process_session_request(action, message, request_id, session_id)
+            return
+        if not self.rate_limiter.acquire(action):
+            self.request_throttled(action, request_id)
+            return
+        if self.throttled:
+            log.warn('Commands of {} were throttled: {}'.format(
+                self.get_client_name(), self.throttled), game=self.game)
+            self.throttled = 0
+
+        log_level = logging.DEBUG if action in self.FREQUENT_ACTIONS else logging.INFO
+        if log.isEnabledFor(log_level):
+            log.log(log_level, '[REQUEST] Player: {}, action: {!r}, message:\n{}'.format(
                 self.player.idx if self.player is not None else self.client_address,
-                Action(self.action), self.message), game=self.game)
+                Action(action), message), game=self.game)
 
-            try:
-                data = json.loads(self.message)
-                if not isinstance(data, dict):
-                    raise errors.BadCommand('The command\'s payload is not a dictionary')
-                if self.observer:
-                    self.write_response(*self.observer.action(self.action, data))
-                else:
-                    if self.action not in self.ACTION_MAP or self.action in CONFIG.HIDDEN_COMMANDS:
-                        raise errors.BadCommand('No such action: {}'.format(self.action))
-                    method = self.ACTION_MAP[self.action]
-                    result, message = method(self, data)
-                    self.write_response(result, message)
-
-                    if not self.observer and self.action in self.REPLAY_ACTIONS:
-                        game_db.add_action(self.game_idx, self.action, message=data, player_idx=self.player.idx)
-
-            # Handle errors:
-            except (json.decoder.JSONDecodeError, errors.BadCommand) as err:
-                self.error_response(Result.BAD_COMMAND, err)
-            except errors.AccessDenied as err:
-                self.error_response(Result.ACCESS_DENIED, err)
-            except errors.InappropriateGameState as err:
-                self.error_response(Result.INAPPROPRIATE_GAME_STATE, err)
-            except errors.Timeout as err:
-                self.error_response(Result.TIMEOUT, err)
-            except errors.ResourceNotFound as err:
-                self.error_response(Result.RESOURCE_NOT_FOUND, err)
-            except Exception:
-                log.exception('Got unhandled exception on client command execution', game=self.game)
-                self.error_response(Result.INTERNAL_SERVER_ERROR)
-            finally:
-                self.action = None
-                self.message_len = None
-                self.message = None
-
-    def parse_data(self, data):
-        """ Parses input command.
-        returns: True if command parsing completed
-        """
-        # Read action:
-        if self.action is None:
-            if len(data) < CONFIG.ACTION_HEADER:
-                self.data = data
-                return False
-            self.action = Action(int.from_bytes(data[0:CONFIG.ACTION_HEADER], byteorder='little'))
-            data = data[CONFIG.ACTION_HEADER:]
+        self.request_id = request_id
+        try:
+            data = json.loads(message)
+            if not isinstance(data, dict):
+                raise errors.BadCommand('The command\'s payload is not a dictionary')
+            if self.observer:
+                self.write_response(*self.observer.action(action, data), request_id=request_id)
+            else:
+                if action not in self.ACTION_MAP or action in CONFIG.HIDDEN_COMMANDS:
+                    raise errors.BadCommand('No such action: {}'.format(action))
+                method = self.ACTION_MAP[action]
+                response = method(self, data)
+                # Response can be written later, when the action is completed:
+                if response is not None:
+                    self.write_response(*response, request_id=request_id)
 
-        # Read size of message:
-        if self.message_len is None:
-            if len(data) < CONFIG.MSGLEN_HEADER:
-                self.data = data
-                return False
-            self.message_len = int.from_bytes(data[0:CONFIG.MSGLEN_HEADER], byteorder='little')
-            data = data[CONFIG.MSGLEN_HEADER:]
+                if not self.observer and action in self.REPLAY_ACTIONS and self.hand_off_worker is None:
+                    game_db.add_action(self.game_idx, action, message=data, player_idx=self.player.idx)
 
-        # Read message:
-        if self.message is None:
-            if len(data) < self.message_len:
-                self.data = data
-                return False
-            self.message = data[0:self.message_len].decode('utf-8') or '{}'
-            self.data = data[self.message_len:]
+        # Handle errors:
+        except json.decoder.JSONDecodeError as err:
+            self.error_response(Result.BAD_COMMAND, err, request_id=request_id)
+        except tuple(self.ERROR_RESULTS) as err:
+            self.error_response(self.ERROR_RESULTS[type(err)], err, request_id=request_id)
+        except Exception:
+            log.exception('Got unhandled exception on client command execution', game=self.game)
+            self.error_response(Result.INTERNAL_SERVER_ERROR, request_id=request_id)
+        finally:
+            self.request_id = None
 
-        return True
+    def process_session_request(self, action, message, request_id, session_id):
+        """ Executes command of the player session, the session is started by its first command.
+        """
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = PlayerSession(self, session_id)
+            if len(self.sessions) >= CONFIG.MAX_CONNECTION_SESSIONS:
+                session.error_response(
+                    Result.BAD_COMMAND,
+                    errors.BadCommand('Sessions limit reached: {}'.format(CONFIG.MAX_CONNECTION_SESSIONS)),
+                    request_id=request_id
+                )
+                return
+            self.sessions[session_id] = session
+        session.process_request(action, message, request_id)
+        # The session is finished by LOGOUT:
+        if session.closed:
+            self.sessions.pop(session_id)
+
+    def get_client_name(self):
+        return self.player.name if self.player is not None else self.client_address
 
-    def write_response(self, result, message=None):
+    def request_rejected(self, action, request_id, session_id):
+        """ Responds on the command which exceeds MAX_FRAME_SIZE and closes the connection.
+        The command's message is not received into memory, so the connection can't be used anymore.
+        """
+        log.warn('Command of {} is too large, action: {!r}, closing the connection'.format(
+            self.get_client_name(), action), game=self.game)
+        metrics.inc('requests_rejected')
+        self.session_id = session_id
+        self.error_response(
+            Result.BAD_COMMAND,
+            errors.BadCommand('The command exceeds maximum frame size: {} bytes'.format(CONFIG.MAX_FRAME_SIZE)),
+            request_id=request_id
+        )
+        self.session_id = None
+        self.closed = True
+
+    def request_throttled(self, action, request_id):
+        """ Responds on the command which exceeds rate limits. Throttled commands are counted but not logged.
+        """
+        if not self.throttled:
+            log.warn('Commands of {} are throttled, action: {!r}'.format(
+                self.get_client_name(), action), game=self.game)
+        self.throttled += 1
+        metrics.inc('requests_throttled')
+        metrics.inc('requests_throttled_{}'.format(action.name))
+        if self.player is not None:
+            metrics.inc('requests_throttled_by_{}'.format(self.player.name))
+        self.write_response(Result.THROTTLED, request_id=request_id)
+
+    def drop_player_metrics(self):
+        """ Drops metrics of the player who leaves the game, so their number does not grow with the number of players.
+        """
+        metrics.pop('requests_throttled_by_{}'.format(self.player.name))
+
+    def write_response(self, result, message=None, flags=ResultFlag(0), request_id=None):
         resp_message = '' if message is None else message
-        log.debug('[RESPONSE] Player: {}, result: {!r}, message:\n{}'.format(
-            self.player.idx if self.player is not None else self.client_address,
-            result, resp_message), game=self.game)
-        self.request.sendall(result.to_bytes(CONFIG.RESULT_HEADER, byteorder='little'))
-        self.request.sendall(len(resp_message).to_bytes(CONFIG.MSGLEN_HEADER, byteorder='little'))
-        self.request.sendall(resp_message.encode('utf-8'))
-
-    def error_response(self, result, exception=None):
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug('[RESPONSE] Player: {}, result: {!r}, message:\n{}'.format(
+                self.player.idx if self.player is not None else self.client_address,
+                result, resp_message), game=self.game)
+        if self.compression:
+            resp_message = compress(resp_message)
+        if isinstance(resp_message, CompressedMessage):
+            flags |= ResultFlag.COMPRESSED
+        elif isinstance(resp_message, str):
+            resp_message = resp_message.encode('utf-8')
+        ids = b''
+        if request_id is not None:
+            flags |= ResultFlag.REQUEST_ID
+            ids += request_id.to_bytes(CONFIG.REQUEST_ID_HEADER, byteorder='little')
+        if self.session_id is not None:
+            flags |= ResultFlag.SESSION_ID
+            ids += self.session_id.to_bytes(CONFIG.SESSION_ID_HEADER, byteorder='little')
+        header = (
+            (result | flags).to_bytes(CONFIG.RESULT_HEADER, byteorder='little') + ids +
+            len(resp_message).to_bytes(CONFIG.MSGLEN_HEADER, byteorder='little')
+        )
+        self.write(header, resp_message)
+
+    def write(self, *data: bytes):
+        """ Writes data to the output, the output is sent immediately if it is not corked.
+        """
+        with self.output_lock:
+            self.output.extend(data)
+        if not self.output_corked:
+            self.flush()
+
+    def flush(self):
+        """ Sends all written data by one call.
+        """
+        with self.output_lock:
+            if self.output:
+                data, self.output = self.output, []
+                self.send(*data)
+
+    def error_response(self, result, exception=None, request_id=None):
         if exception is not None:
             str_exception = str(exception)
             log.error(str_exception, game=self.game)
-            error = Serializable()
+            error = Message()
             error.set_attributes(error=str_exception)
-            response_msg = error.to_json_str()
+            response_msg = error.serialize(self.encoding)
         else:
             response_msg = None
-        self.write_response(result, response_msg)
+        self.write_response(result, response_msg, request_id=request_id)
 
     @staticmethod
     def check_keys(data: dict, keys, agg_func=all):
@@ -175,6 +471,53 @@ class GameServerRequestHandler(BaseRequestHandler):
         else:
             return True
 
+    @staticmethod
+    def check_drained_game(game_name):
+        """ Refuses the game which is still served by the previous server process after restart.
+        Connections of the game's players are kept by the previous process, reconnected players can't return.
+        """
+        if (game_name in GameServerProtocol.DRAINED_GAMES and
+                time.monotonic() < GameServerProtocol.DRAINED_GAMES_DEADLINE):
+            raise errors.AccessDenied('The game is served by the previous server process, it can\'t be joined '
+                                      'after the server restart')
+
+    @staticmethod
+    def get_encoding(data: dict):
+        """ Returns wire encoding requested by the client.
+        """
+        encoding = data.get('encoding', Encoding.JSON)
+        if not Serializable.is_encoding_available(encoding):
+            raise errors.BadCommand('Encoding is not supported: {}'.format(encoding))
+        return Encoding(encoding)
+
+    @staticmethod
+    def get_flag(data: dict, name):
+        """ Returns value of the command's optional boolean flag.
+        """
+        flag = data.get(name, False)
+        if not isinstance(flag, bool):
+            raise errors.BadCommand('The {} flag is not a boolean: {}'.format(name, flag))
+        return flag
+
+    @staticmethod
+    def get_compression(data: dict):
+        """ Returns True if the client accepts compressed responses.
+        """
+        return GameServerProtocol.get_flag(data, 'compression')
+
+    def hand_off_to_game_owner(self, game_name, action, data: dict):
+        """ Prepares the connection to be passed to the server process which serves the game.
+        returns: True if the game is served by another server process, the command is executed by it
+        """
+        if Game.CLUSTER is None or Game.CLUSTER.is_game_owner(game_name):
+            return False
+        if self.session_id is not None or self.sessions:
+            raise errors.BadCommand('The game is served by another server process, '
+                                    'it can not be joined by the connection with sessions')
+        self.hand_off_worker = Game.CLUSTER.get_game_owner(game_name)
+        self.hand_off_data = self.encode_request(action, json.dumps(data), self.request_id)
+        return True
+
     def on_login(self, data: dict):
         if self.game is not None or self.player is not None:
             raise errors.BadCommand('You are already logged in')
@@ -182,12 +525,23 @@ class GameServerRequestHandler(BaseRequestHandler):
         self.check_keys(data, ['name'])
         player_name = data['name']
         password = data.get('password', None)
+        game_name = data.get('game', 'Game of {}'.format(player_name))
+        encoding = self.get_encoding(data)
+        compression = self.get_compression(data)
+        resumable = self.get_flag(data, 'resumable')
+        self.check_drained_game(game_name)
+
+        if self.hand_off_to_game_owner(game_name, Action.LOGIN, data):
+            return None
+
+        # Players can join only games which are already running on the draining server:
+        if self.DRAINING and game_name not in Game.GAMES:
+            raise errors.AccessDenied('The server is restarting, new games are not accepted')
 
         player = Player.get(player_name, password=password)
         if not player.check_password(password):
             raise errors.AccessDenied('Password mismatch')
 
-        game_name = data.get('game', 'Game of {}'.format(player_name))
         num_players = data.get('num_players', CONFIG.DEFAULT_NUM_PLAYERS)
         num_turns = data.get('num_turns', CONFIG.DEFAULT_NUM_TURNS)
 
@@ -198,29 +552,88 @@ class GameServerRequestHandler(BaseRequestHandler):
         self.game = game
         self.game_idx = game.game_idx
         self.player = player
+        self.encoding = encoding
+        self.compression = compression
 
         log.info('Player successfully logged in: {}'.format(player), game=self.game)
-        message = self.player.to_json_str()
+        # The token allows to return to the game by RESUME:
+        extra_attributes = {'resume_token': player.resume_token} if resumable else None
+        message = self.player.serialize(self.encoding, extra_attributes=extra_attributes)
 
         return Result.OKEY, message
 
+    def on_resume(self, data: dict):
+        """ Returns the player to the game by the resumption token, which is issued on resumable LOGIN.
+        Responds with short acknowledgement instead of the player's data, the acknowledgement contains new token.
+        """
+        if self.game is not None or self.player is not None:
+            raise errors.BadCommand('You are already logged in')
+
+        self.check_keys(data, ['game', 'token'])
+        game_name = data['game']
+        encoding = self.get_encoding(data)
+        compression = self.get_compression(data)
+        self.check_drained_game(game_name)
+
+        if self.hand_off_to_game_owner(game_name, Action.RESUME, data):
+            return None
+
+        game = Game.GAMES.get(game_name, None)
+        if game is None:
+            raise errors.AccessDenied('Resumption token is not valid')
+        game.check_state(GameState.INIT, GameState.RUN)
+        player = game.resume_player(data['token'])
+        if player is None:
+            raise errors.AccessDenied('Resumption token is not valid')
+
+        self.game = game
+        self.game_idx = game.game_idx
+        self.player = player
+        self.encoding = encoding
+        self.compression = compression
+        # The player's return is replayed as LOGIN:
+        game_db.add_action(self.game_idx, Action.LOGIN, message={'name': player.name}, player_idx=player.idx)
+
+        log.info('Player successfully resumed: {}'.format(player.idx), game=self.game)
+        resume = Message()
+        resume.set_attributes(idx=player.idx, tick=game.current_tick, resume_token=player.resume_token)
+        return Result.OKEY, resume.serialize(self.encoding)
+
     @login_required
     def on_logout(self, _):
         log.info('Logout player: {}'.format(self.player.name), game=self.game)
-        self.game.remove_player(self.player)
+        self.game.unsubscribe(self.on_tick_notification)
+        self.drop_player_metrics()
+        self.game.remove_player(self.player, logout=True)
         self.closed = True
         return Result.OKEY, None
 
     @login_required
     def on_get_map(self, data: dict):
         self.check_keys(data, ['layer'])
-        message = self.game.get_map_layer(self.player, data['layer'])
+        message = self.game.get_map_layer(
+            self.player, data['layer'], self.encoding, self.compression, since_tick=data.get('since_tick', None)
+        )
         return Result.OKEY, message
 
+    def move_train(self, data: dict):
+        check_move_payload(data)
+        self.game.move_train(self.player, data['train_idx'], data['speed'], data['line_idx'])
+
+    def make_upgrade(self, data: dict):
+        self.check_keys(data, ['trains', 'posts'], agg_func=any)
+        for key in ('posts', 'trains'):
+            indexes = data.get(key, [])
+            if not isinstance(indexes, list) or any(type(idx) is not int for idx in indexes):
+                raise errors.BadCommand('The command\'s payload key \'{}\' is not a list of indexes'.format(key))
+        self.game.make_upgrade(
+            self.player, posts_idx=data.get('posts', []), trains_idx=data.get('trains', [])
+        )
+
     @login_required
     def on_move(self, data: dict):
-        self.check_keys(data, ['train_idx', 'speed', 'line_idx'])
         self.game.check_state(GameState.RUN)
+        check_move_payload(data)
         with self.player.lock:
             self.game.move_train(self.player, data['train_idx'], data['speed'], data['line_idx'])
         return Result.OKEY, None
@@ -228,41 +641,129 @@ class GameServerRequestHandler(BaseRequestHandler):
     @login_required
     def on_turn(self, _):
         self.game.check_state(GameState.RUN)
-        self.game.turn(self.player)
+        tick_done = self.game.turn(self.player)
+        if self.request_id is not None:
+            # Following commands are executed while waiting for the tick, the response is written out of order:
+            self.defer_turn(tick_done)
+            return None
+        try:
+            tick_done.result(CONFIG.TURN_TIMEOUT)
+        except FutureTimeoutError:
+            raise errors.Timeout('Game tick did not happen')
         return Result.OKEY, None
 
+    def defer_turn(self, tick_done):
+        """ Writes response on TURN when the game tick is done.
+        """
+        request_id = self.request_id
+        tick_done.add_done_callback(lambda future: self.turn_completed(future, request_id))
+
+    def turn_completed(self, tick_done, request_id):
+        """ Writes response on TURN with request id when the game tick is done. Called by the game loop.
+        """
+        try:
+            tick_done.result()
+        except tuple(self.ERROR_RESULTS) as err:
+            self.error_response(self.ERROR_RESULTS[type(err)], err, request_id=request_id)
+        except Exception:
+            log.exception('Got unhandled exception on game tick', game=self.game)
+            self.error_response(Result.INTERNAL_SERVER_ERROR, request_id=request_id)
+        else:
+            self.write_response(Result.OKEY, request_id=request_id)
+        self.flush()
+
     @login_required
     def on_upgrade(self, data: dict):
-        self.check_keys(data, ['trains', 'posts'], agg_func=any)
         self.game.check_state(GameState.RUN)
         with self.player.lock:
-            self.game.make_upgrade(
-                self.player, posts_idx=data.get('posts', []), trains_idx=data.get('trains', [])
-            )
+            self.make_upgrade(data)
+        return Result.OKEY, None
+
+    def apply_batch_action(self, item):
+        """ Applies one command of the batch.
+        """
+        if not isinstance(item, dict):
+            raise errors.BadCommand('The batch\'s command is not a dictionary')
+        self.check_keys(item, ['action', 'data'])
+        if type(item['action']) is not int or item['action'] not in self.BATCH_ACTIONS:
+            raise errors.BadCommand('The action is not allowed in batch: {}'.format(item['action']))
+        if not isinstance(item['data'], dict):
+            raise errors.BadCommand('The command\'s payload is not a dictionary')
+        self.BATCH_ACTIONS[item['action']](self, item['data'])
+
+    @login_required
+    def on_batch(self, data: dict):
+        self.check_keys(data, ['actions'])
+        if not isinstance(data['actions'], list):
+            raise errors.BadCommand('The batch\'s actions is not a list')
+        self.game.check_state(GameState.RUN)
+
+        results = []
+        applied_actions = []
+        try:
+            with self.player.lock:
+                for item in data['actions']:
+                    try:
+                        self.apply_batch_action(item)
+                    except tuple(self.ERROR_RESULTS) as err:
+                        log.error(str(err), game=self.game)
+                        results.append({'result': self.ERROR_RESULTS[type(err)], 'error': str(err)})
+                    else:
+                        results.append({'result': Result.OKEY})
+                        applied_actions.append(item)
+        finally:
+            # Only applied commands are replayed (even if the batch is interrupted by unexpected error):
+            if applied_actions:
+                game_db.add_action(
+                    self.game_idx, Action.BATCH, message={'actions': applied_actions}, player_idx=self.player.idx
+                )
+
+        batch = Message()
+        batch.set_attributes(results=results)
+        return Result.OKEY, batch.serialize(self.encoding)
+
+    @login_required
+    def on_subscribe(self, data: dict):
+        layer = data.get('layer', None)
+        if layer is not None:
+            self.game.check_map_layer(layer)
+        self.subscription_layer = layer
+        self.game.unsubscribe(self.on_tick_notification)
+        self.game.subscribe(self.on_tick_notification)
         return Result.OKEY, None
 
+    def on_tick_notification(self):
+        """ Pushes notification about the game tick to the client. Called by the game loop.
+        """
+        message = self.game.get_tick_notification(self.player, self.subscription_layer, self.encoding)
+        self.write_response(Result.OKEY, message, flags=ResultFlag.NOTIFICATION)
+        self.flush()
+
     @login_required
     def on_player(self, _):
-        message = self.player.to_json_str()
+        message = self.player.serialize(self.encoding)
         return Result.OKEY, message
 
     def on_list_games(self, _):
-        games = Serializable()
+        games = Message()
         games.set_attributes(
             games=Game.get_all_active_games()
         )
-        return Result.OKEY, games.to_json_str()
+        return Result.OKEY, games.serialize(self.encoding)
 
-    def on_observer(self, _):
+    def on_observer(self, data: dict):
         if self.game or self.observer:
             raise errors.BadCommand('Impossible to connect as observer')
         else:
-            self.observer = Observer()
-            message = self.observer.games_to_json_str()
+            self.encoding = self.get_encoding(data)
+            self.compression = self.get_compression(data)
+            self.observer = Observer(encoding=self.encoding, compression=self.compression)
+            message = self.observer.serialize_games()
             return Result.OKEY, message
 
     ACTION_MAP = {
         Action.LOGIN: on_login,
+        Action.RESUME: on_resume,
         Action.LOGOUT: on_logout,
         Action.MAP: on_get_map,
         Action.MOVE: on_move,
@@ -270,34 +771,753 @@ class GameServerRequestHandler(BaseRequestHandler):
         Action.TURN: on_turn,
         Action.PLAYER: on_player,
         Action.GAMES: on_list_games,
+        Action.BATCH: on_batch,
+        Action.SUBSCRIBE: on_subscribe,
         Action.OBSERVER: on_observer,
     }
+    BATCH_ACTIONS = {
+        Action.MOVE: move_train,
+        Action.UPGRADE: make_upgrade,
+    }
+    ERROR_RESULTS = {
+        errors.BadCommand: Result.BAD_COMMAND,
+        errors.AccessDenied: Result.ACCESS_DENIED,
+        errors.InappropriateGameState: Result.INAPPROPRIATE_GAME_STATE,
+        errors.Timeout: Result.TIMEOUT,
+        errors.ResourceNotFound: Result.RESOURCE_NOT_FOUND,
+    }
     REPLAY_ACTIONS = {
         Action.LOGIN,
         Action.LOGOUT,
         Action.MOVE,
         Action.UPGRADE,
     }
+    # Frequent actions are logged at DEBUG level:
+    FREQUENT_ACTIONS = {
+        Action.MOVE,
+        Action.TURN,
+    }
 
 
-@task
-def run_server(_, address=CONFIG.SERVER_ADDR, port=CONFIG.SERVER_PORT, log_level='INFO'):
-    """ Launches 'WG Forge' TCP server.
+class PlayerSession(GameServerProtocol):
+    """ Player (or observer) session multiplexed with other sessions over one connection, addressed by session id.
+    Commands of the session are executed by the connection, responses are written to the connection's output.
+    """
+
+    def __init__(self, connection, session_id):
+        self.init_session()
+        self.connection = connection
+        self.session_id = session_id
+        self.client_address = connection.client_address
+        # Each session is limited as separate connection, the number of sessions is limited too:
+        self.rate_limiter = RateLimiter()
+        self.closed = False
+
+    def write(self, *data: bytes):
+        self.connection.write(*data)
+
+    def flush(self):
+        self.connection.flush()
+
+    @login_required
+    def on_turn(self, _):
+        self.game.check_state(GameState.RUN)
+        # TURN does not block commands of other sessions of the connection:
+        self.defer_turn(self.game.turn(self.player))
+
+    ACTION_MAP = dict(GameServerProtocol.ACTION_MAP)
+    ACTION_MAP[Action.TURN] = on_turn
+
+
+class ConnectionReaper(Thread):
+    """ Periodically closes dead connections: idle, not completing commands or not reading responses.
+    Logs server metrics (reaped connections, throttled players, etc.) while the server runs.
+    """
+
+    def __init__(self):
+        super(ConnectionReaper, self).__init__(name='ConnectionReaper', daemon=True)
+        self.stop_event = Event()
+        self.logged_metrics = {}
+        self.metrics_logged_at = time.monotonic()
+
+    def run(self):
+        while not self.stop_event.wait(CONFIG.REAPER_PERIOD):
+            try:
+                GameServerProtocol.reap_dead_connections()
+            except Exception:
+                log.exception('Got unhandled exception on connections reaping')
+            if time.monotonic() - self.metrics_logged_at >= CONFIG.METRICS_LOG_PERIOD:
+                self.log_metrics()
+
+    def log_metrics(self):
+        """ Logs server metrics if they are changed since the last logging.
+        """
+        self.metrics_logged_at = time.monotonic()
+        current_metrics = metrics.to_dict()
+        if current_metrics != self.logged_metrics:
+            log.info('Server metrics: {}'.format(current_metrics))
+            self.logged_metrics = current_metrics
+
+    def stop(self):
+        self.stop_event.set()
+
+
+class ServerDrainer(Thread):
+    """ Drains the server: stops accepting connections, lets running games finish and stops the server.
+    New connections are accepted by the successor server process, which inherits the listening socket.
+    """
+
+    def __init__(self, server, restart=True):
+        super(ServerDrainer, self).__init__(name='ServerDrainer', daemon=True)
+        self.server = server
+        self.restart = restart
+        self.requested = Event()
+
+    def request(self):
+        """ Starts draining, can be called from a signal handler.
+        """
+        if not self.requested.is_set():
+            self.requested.set()
+            self.start()
+
+    def run(self):
+        log.warn('Draining the server, waiting for running games...')
+        GameServerProtocol.DRAINING = True
+        try:
+            # Players of not started games log in again, and the games are created by the successor:
+            Game.stop_waiting_games()
+            if self.restart:
+                # Running games stay here, the successor refuses players who reconnect to them:
+                running_games = [game['name'] for game in Game.get_local_active_games()]
+                start_successor(self.server.socket, self.server.unix_socket, drained_games=running_games)
+            self.server.stop_accepting()
+            deadline = time.monotonic() + CONFIG.DRAIN_TIMEOUT
+            while Game.get_local_active_games() and time.monotonic() < deadline:
+                time.sleep(CONFIG.DRAIN_CHECK_PERIOD)
+        except Exception:
+            log.exception('Got unhandled exception on server draining')
+        finally:
+            log.warn('Server is drained, shutting down...')
+            self.server.shutdown()
+
+
+class OutputFlusher(Thread):
+    """ Sends output of the threaded server's connections when their sockets are ready to send,
+    so neither handlers nor the game loop wait for slow clients.
+    """
+
+    def __init__(self):
+        super(OutputFlusher, self).__init__(name='OutputFlusher', daemon=True)
+        self.selector = selectors.DefaultSelector()
+        self.changes = Queue()
+        self.wakeup_receiver, self.wakeup_sender = socket.socketpair()
+        self.wakeup_receiver.setblocking(False)
+        self.selector.register(self.wakeup_receiver, selectors.EVENT_READ)
+        self.stopped = False
+
+    def add(self, handler):
+        """ Sends pending output of the handler when its socket is ready, can be called from any thread.
+        """
+        self.changes.put((handler, True))
+        self.wakeup_sender.send(b'\x00')
+
+    def remove(self, handler):
+        self.changes.put((handler, False))
+        self.wakeup_sender.send(b'\x00')
+
+    def stop(self):
+        self.stopped = True
+        self.wakeup_sender.send(b'\x00')
+
+    def apply_changes(self):
+        while True:
+            try:
+                handler, add = self.changes.get_nowait()
+            except Empty:
+                break
+            # Closed sockets are removed from the selector's registry by handlers, not by the OS:
+            for key in list(self.selector.get_map().values()):
+                if key.data is handler or (add and key.fd == handler.request.fileno()):
+                    self.selector.unregister(key.fd)
+            if add and handler.request.fileno() != -1:
+                self.selector.register(handler.request.fileno(), selectors.EVENT_WRITE, handler)
+
+    def run(self):
+        while not self.stopped:
+            for key, _ in self.selector.select():
+                if key.fileobj is self.wakeup_receiver:
+                    self.wakeup_receiver.recv(CONFIG.RECEIVE_CHUNK_SIZE)
+                    self.apply_changes()
+                elif not key.data.send_pending_output():
+                    self.selector.unregister(key.fd)
+        self.selector.close()
+        self.wakeup_receiver.close()
+        self.wakeup_sender.close()
+
+
+class GameServerRequestHandler(GameServerProtocol, ConnectionTransport, BaseRequestHandler):
+    """ Connection handler of the threaded server, each connection is served by its own thread.
+    Data is sent without blocking, output which can't be sent immediately is sent by the server's flusher.
+    """
+
+    # Max number of buffers which can be sent by one sendmsg call:
+    MAX_SEND_BUFFERS = os.sysconf('SC_IOV_MAX')
+
+    def __init__(self, *args, **kwargs):
+        self.init_connection()
+        self.pending_output = deque()
+        self.pending_output_size = 0
+        self.output_sent = Event()
+        self.output_sent.set()
+        super(GameServerRequestHandler, self).__init__(*args, **kwargs)
+
+    def setup(self):
+        self.connection_opened()
+
+    def handle(self):
+        data = self.server.pop_initial_data(self.request)
+        if data:
+            self.data_received(data)
+        while not self.closed:
+            if self.hand_off_worker is not None:
+                self.hand_off()
+                continue
+            nbytes = self.request.recv_into(self.get_buffer())
+            if nbytes:
+                self.buffer_updated(nbytes)
+            else:
+                self.closed = True
+
+    def finish(self):
+        if not self.output_sent.wait(CONFIG.CLOSE_FLUSH_TIMEOUT):
+            log.warn('Unable to send pending output to {}'.format(self.client_address), game=self.game)
+        self.server.flusher.remove(self)
+        self.connection_closed()
+
+    def send(self, *data: bytes):
+        with self.output_lock:
+            for chunk in data:
+                if chunk:
+                    self.pending_output.append(memoryview(chunk))
+                    self.pending_output_size += len(chunk)
+            if self.output_sent.is_set() and self.send_pending_output():
+                self.server.flusher.add(self)
+            if self.pending_output_size > CONFIG.MAX_OUTPUT_SIZE:
+                self.pending_output.clear()
+                self.pending_output_size = 0
+                self.output_sent.set()
+                self.drop_slow_consumer()
+
+    def send_pending_output(self):
+        """ Sends pending output without blocking.
+        returns: True if the output is not sent completely
+        """
+        with self.output_lock:
+            output_size = self.pending_output_size
+            while self.pending_output:
+                try:
+                    sent = self.request.sendmsg(
+                        list(itertools.islice(self.pending_output, self.MAX_SEND_BUFFERS)), [], socket.MSG_DONTWAIT
+                    )
+                except BlockingIOError:
+                    break
+                except OSError:
+                    # Connection is broken, the handler finds it out on receiving:
+                    self.pending_output.clear()
+                    self.pending_output_size = 0
+                    break
+                self.pending_output_size -= sent
+                # Skip sent data, the rest is sent by the next call:
+                while self.pending_output and sent >= len(self.pending_output[0]):
+                    sent -= len(self.pending_output.popleft())
+                if sent:
+                    self.pending_output[0] = self.pending_output[0][sent:]
+            if self.pending_output_size < output_size:
+                self.last_activity = time.monotonic()
+            if self.pending_output:
+                if self.output_blocked_since is None or self.pending_output_size < output_size:
+                    self.output_blocked_since = time.monotonic()
+                self.output_sent.clear()
+                return True
+            else:
+                self.output_blocked_since = None
+                self.output_sent.set()
+                return False
+
+    def close_connection(self):
+        self.request.shutdown(socket.SHUT_RDWR)
+
+    def abort_connection(self):
+        self.close_connection()
+
+    def detach_socket(self):
+        if not self.output_sent.wait(CONFIG.CLOSE_FLUSH_TIMEOUT):
+            log.warn('Unable to send pending output to {}'.format(self.client_address), game=self.game)
+        self.server.flusher.remove(self)
+        return self.request.detach()
+
+
+class AsyncGameServerProtocol(GameServerProtocol, ConnectionTransport, asyncio.BufferedProtocol):
+    """ Connection handler of the asyncio server. Parsed commands are executed one by one in the server's thread pool,
+    TURN does not occupy a thread while waiting for the game tick.
+    """
+
+    def __init__(self, server):
+        self.init_connection()
+        self.server = server
+        self.loop = server.loop
+        self.transport = None
+        self.client_address = None
+        self.requests = asyncio.Queue()
+        self.requests_task = None
+        self.request_future = None  # Execution of the current command in the thread pool.
+        # Receiving of commands is paused while too many received commands wait for execution:
+        self.reading_paused = False
+        self.turn_done = None
+        # Responses are sent when all received commands are executed:
+        self.output_corked = True
+        # Commands are not executed while the transport's write buffer is full:
+        self.writing_resumed = asyncio.Event()
+        self.writing_resumed.set()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.client_address = transport.get_extra_info('peername')
+        if self.is_connections_limit_reached():
+            self.reject_connection(self.client_address)
+            self.closed = True
+            self.transport.abort()
+            return
+        self.connection_opened()
+        self.requests_task = self.loop.create_task(self.process_requests())
+
+    def connection_lost(self, exc):
+        self.closed = True
+        if self.requests_task is None:
+            return  # The connection is rejected.
+        self.requests_task.cancel()
+        # The connection is finished when execution of the current command is completed:
+        if self.request_future is None:
+            self.server.executor.submit(self.connection_closed)
+        else:
+            self.request_future.add_done_callback(lambda _: self.server.executor.submit(self.connection_closed))
+
+    def pause_writing(self):
+        self.output_blocked_since = time.monotonic()
+        self.writing_resumed.clear()
+
+    def resume_writing(self):
+        self.output_blocked_since = None
+        self.writing_resumed.set()
+
+    def request_received(self, action, message, request_id=None, session_id=None):
+        self.requests.put_nowait((action, message, request_id, session_id))
+        if not self.reading_paused and self.requests.qsize() >= CONFIG.MAX_PENDING_REQUESTS:
+            self.reading_paused = True
+            self.transport.pause_reading()
+
+    async def process_requests(self):
+        """ Executes received commands in order of receiving.
+        """
+        while not self.closed:
+            request = await self.requests.get()
+            if self.reading_paused and self.requests.qsize() <= CONFIG.MAX_PENDING_REQUESTS // 2:
+                self.reading_paused = False
+                self.transport.resume_reading()
+            await self.writing_resumed.wait()
+            self.request_future = self.server.executor.submit(self.process_request, *request)
+            await asyncio.wrap_future(self.request_future)
+            if self.hand_off_worker is not None:
+                self.hand_off()
+            if self.turn_done is not None:
+                await self.wait_for_turn()
+            # Output is not kept corked while the client floods the connection, so it is limited by pause_writing:
+            if self.requests.empty() or self.reading_paused or self.closed:
+                self.flush()
+            if self.closed:
+                self.transport.close()
+
+    async def wait_for_turn(self):
+        """ Waits for the game tick and writes response on TURN.
+        """
+        try:
+            await asyncio.wait_for(asyncio.wrap_future(self.turn_done), CONFIG.TURN_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.error_response(Result.TIMEOUT, errors.Timeout('Game tick did not happen'))
+        except tuple(self.ERROR_RESULTS) as err:
+            self.error_response(self.ERROR_RESULTS[type(err)], err)
+        except Exception:
+            log.exception('Got unhandled exception on game tick', game=self.game)
+            self.error_response(Result.INTERNAL_SERVER_ERROR)
+        else:
+            self.write_response(Result.OKEY)
+        finally:
+            self.turn_done = None
+
+    @login_required
+    def on_turn(self, data):
+        if self.request_id is not None:
+            return super(AsyncGameServerProtocol, self).on_turn(data)
+        self.game.check_state(GameState.RUN)
+        # The response is written when the game loop resolves the future:
+        self.turn_done = self.game.turn(self.player)
+
+    def call_in_loop(self, callback, *args):
+        """ Calls the callback in the event loop's thread, immediately if called from the event loop.
+        """
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self.loop:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def flush(self):
+        # Data is sent by the event loop only, so the order of sent data is kept:
+        self.call_in_loop(super(AsyncGameServerProtocol, self).flush)
+
+    def send(self, *data: bytes):
+        if self.transport.is_closing():
+            return
+        self.transport.writelines(data)
+        self.last_activity = time.monotonic()
+        if self.transport.get_write_buffer_size() > CONFIG.MAX_OUTPUT_SIZE:
+            self.drop_slow_consumer()
+
+    def close_connection(self):
+        self.call_in_loop(self.transport.close)
+
+    def abort_connection(self):
+        self.call_in_loop(self.transport.abort)
+
+    def detach_socket(self):
+        fd = os.dup(self.transport.get_extra_info('socket').fileno())
+        self.transport.abort()
+        return fd
+
+    def take_received_data(self):
+        data = b''
+        while not self.requests.empty():
+            action, message, request_id, session_id = self.requests.get_nowait()
+            if message is None:
+                raise errors.BadCommand('The connection can\'t be passed while a large command is received')
+            data += self.encode_request(action, message, request_id, session_id)
+        return data + super(AsyncGameServerProtocol, self).take_received_data()
+
+    ACTION_MAP = dict(GameServerProtocol.ACTION_MAP)
+    ACTION_MAP[Action.TURN] = on_turn
+
+
+class AsyncGameServer(object):
+    """ Asyncio game server, all connections are served by one event loop.
+    Provides the same interface as socketserver's servers.
+    """
+
+    def __init__(self, server_address, sock=None, unix_sock=None):
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=CONFIG.ASYNC_EXECUTOR_WORKERS)
+        if sock is None:
+            create_server = self.loop.create_server(self.create_protocol, *server_address, reuse_address=True)
+        else:
+            create_server = self.loop.create_server(self.create_protocol, sock=sock)
+        self.server = self.loop.run_until_complete(create_server)
+        self.socket = self.server.sockets[0]
+        self.unix_server = self.unix_socket = None
+        if unix_sock is not None:
+            self.unix_server = self.loop.run_until_complete(
+                self.loop.create_unix_server(self.create_protocol, sock=unix_sock))
+            self.unix_socket = self.unix_server.sockets[0]
+
+    def create_protocol(self):
+        return AsyncGameServerProtocol(self)
+
+    def adopt_connection(self, sock, client_address, data):
+        """ Serves connection accepted by another server process, can be called from any thread.
+        """
+        asyncio.run_coroutine_threadsafe(self.connect_accepted_socket(sock, data), self.loop)
+
+    async def connect_accepted_socket(self, sock, data):
+        _, protocol = await self.loop.connect_accepted_socket(self.create_protocol, sock)
+        if data:
+            protocol.data_received(data)
+
+    def serve_forever(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def stop_accepting(self):
+        """ Closes the listening sockets, accepted connections are served until shutdown.
+        """
+        self.loop.call_soon_threadsafe(self.server.close)
+        if self.unix_server is not None:
+            self.loop.call_soon_threadsafe(self.unix_server.close)
+
+    def shutdown(self):
+        if self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def server_close(self):
+        for server in (self.server, self.unix_server):
+            if server is not None:
+                server.close()
+                self.loop.run_until_complete(server.wait_closed())
+        self.executor.shutdown(wait=False)
+        self.loop.close()
+
+
+class ThreadingGameServer(ThreadingTCPServer):
+    """ Threaded game server, each connection is served by its own thread.
+    """
+
+    allow_reuse_address = True
+
+    def __init__(self, server_address, sock=None, unix_sock=None):
+        super(ThreadingGameServer, self).__init__(
+            server_address, GameServerRequestHandler, bind_and_activate=sock is None
+        )
+        if sock is not None:
+            self.socket.close()
+            self.socket = sock
+            self.server_address = sock.getsockname()
+        self.initial_data = {}
+        self.flusher = OutputFlusher()
+        self.flusher.start()
+        self.unix_server = self.unix_socket = None
+        if unix_sock is not None:
+            self.unix_server = ThreadingUnixGameServer(self, unix_sock)
+            self.unix_socket = unix_sock
+
+    def serve_forever(self, poll_interval=0.5):
+        if self.unix_server is not None:
+            Thread(target=self.unix_server.serve_forever, args=(poll_interval, ), daemon=True).start()
+        super(ThreadingGameServer, self).serve_forever(poll_interval)
+
+    def shutdown(self):
+        if self.unix_server is not None:
+            self.unix_server.shutdown()
+        super(ThreadingGameServer, self).shutdown()
+
+    def verify_request(self, request, client_address):
+        if GameServerProtocol.is_connections_limit_reached():
+            GameServerProtocol.reject_connection(client_address)
+            return False
+        return True
+
+    def adopt_connection(self, sock, client_address, data):
+        """ Serves connection accepted by another server process, can be called from any thread.
+        """
+        self.initial_data[sock.fileno()] = data
+        self.process_request(sock, client_address)
+
+    def pop_initial_data(self, request):
+        return self.initial_data.pop(request.fileno(), None)
+
+    def stop_accepting(self):
+        """ Stops the accepting loop, accepted connections are served by their threads until shutdown.
+        """
+        self.shutdown()
+
+    def server_close(self):
+        super(ThreadingGameServer, self).server_close()
+        if self.unix_server is not None:
+            self.unix_server.server_close()
+        self.flusher.stop()
+
+
+class ThreadingUnixGameServer(ThreadingUnixStreamServer):
+    """ Accepts connections of local clients on the unix domain socket for the threaded game server,
+    the connections are served the same way as TCP ones.
+    """
+
+    def __init__(self, game_server, sock):
+        super(ThreadingUnixGameServer, self).__init__(
+            sock.getsockname(), GameServerRequestHandler, bind_and_activate=False
+        )
+        self.socket.close()
+        self.socket = sock
+        self.flusher = game_server.flusher
+
+    def verify_request(self, request, client_address):
+        return ThreadingGameServer.verify_request(self, request, client_address)
+
+    @staticmethod
+    def pop_initial_data(request):
+        return None
+
+
+SERVER_ENGINES = {
+    'threading': ThreadingGameServer,
+    'asyncio': AsyncGameServer,
+}
+
+
+def start_successor(sock, unix_sock=None, drained_games=()):
+    """ Starts new server process with the same arguments, the process inherits the listening sockets.
+    Games which are still running on this process (drained games) are passed to the successor.
+    """
+    env = dict(os.environ)
+    env['SERVER_DRAINED_GAMES'] = json.dumps(list(drained_games))
+    pass_fds = []
+    for env_name, listening_sock in (('SERVER_LISTEN_FD', sock), ('SERVER_UNIX_LISTEN_FD', unix_sock)):
+        if listening_sock is not None:
+            # The successor and this process accept connections concurrently until this process stops accepting:
+            os.set_blocking(listening_sock.fileno(), False)
+            env[env_name] = str(listening_sock.fileno())
+            pass_fds.append(listening_sock.fileno())
+    process = subprocess.Popen([sys.executable] + sys.argv, env=env, pass_fds=pass_fds)
+    log.warn('Successor server process is started, pid: {}'.format(process.pid))
+
+
+def get_inherited_socket(env_name='SERVER_LISTEN_FD'):
+    """ Returns the listening socket inherited from the previous server process, if any.
+    """
+    listen_fd = os.environ.pop(env_name, None)
+    if listen_fd is None:
+        return None
+    sock = socket.socket(fileno=int(listen_fd))
+    sock.setblocking(False)
+    log.warn('Listening socket {} is inherited from the previous server process'.format(sock.getsockname()))
+    return sock
+
+
+def set_drained_games():
+    """ Refuses games which are still running on the previous server process, until it is drained.
+    """
+    drained_games = os.environ.pop('SERVER_DRAINED_GAMES', None)
+    if drained_games is None:
+        return
+    GameServerProtocol.DRAINED_GAMES = frozenset(json.loads(drained_games))
+    GameServerProtocol.DRAINED_GAMES_DEADLINE = time.monotonic() + CONFIG.DRAIN_TIMEOUT
+    log.warn('Games of the previous server process: {}'.format(len(GameServerProtocol.DRAINED_GAMES)))
+
+
+def bind_unix_socket(path):
+    """ Returns listening unix domain socket, the socket file left by the previous server run is replaced.
+    """
+    if os.path.exists(path):
+        os.unlink(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.listen(CONFIG.LISTEN_BACKLOG)
+    return sock
+
+
+def serve(server, restart_on_drain=True):
+    """ Serves connections until keyboard interrupt or until the server is drained (on SIGUSR2).
     """
-    log.setLevel(log_level)
-    ThreadingTCPServer.allow_reuse_address = True
-    server = ThreadingTCPServer((address, port), GameServerRequestHandler)
     log.info('Serving on {}'.format(server.socket.getsockname()))
+    if server.unix_socket is not None:
+        log.info('Serving on unix socket {}'.format(server.unix_socket.getsockname()))
+    reaper = ConnectionReaper()
+    reaper.start()
+    drainer = ServerDrainer(server, restart=restart_on_drain)
+    signal.signal(signal.SIGUSR2, lambda *_: drainer.request())
     try:
         server.serve_forever()
+        # The threaded server stops its loop as soon as draining is started:
+        if drainer.requested.is_set():
+            drainer.join()
     except KeyboardInterrupt:
         log.warn('Server stopped by keyboard interrupt, shutting down...')
     finally:
+        reaper.stop()
         try:
-            GameServerRequestHandler.shutdown_all_sockets()
+            GameServerProtocol.shutdown_all_sockets()
             Game.stop_all_games()
-            if log.is_queued:
-                log.stop()
         finally:
             server.shutdown()
             server.server_close()
+            log.info('Server metrics: {}'.format(metrics.to_dict()))
+
+
+def serve_worker(cluster, worker_idx, engine, sock, unix_sock):
+    """ Serves connections in the worker process of the sharded server.
+    """
+    # Workers are stopped by the main process:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    cluster.start_worker(worker_idx)
+    Game.CLUSTER = cluster
+    server = SERVER_ENGINES[engine](sock.getsockname(), sock=sock, unix_sock=unix_sock)
+    Thread(target=cluster.serve_hand_offs, args=(server.adopt_connection, ), daemon=True).start()
+    # The successor server is started by the main process:
+    serve(server, restart_on_drain=False)
+
+
+def serve_cluster(server_address, engine, workers, sock=None, unix_sock=None):
+    """ Forks worker processes which accept connections on the same listening socket.
+    Each game is served by one worker, connections are passed to the game's worker on LOGIN.
+    """
+    if sock is None:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(server_address)
+        sock.listen(CONFIG.LISTEN_BACKLOG)
+    # Worker which is not first to accept the connection should not be blocked:
+    sock.setblocking(False)
+    if unix_sock is not None:
+        unix_sock.setblocking(False)
+
+    cluster = Cluster(workers, listening_socks=[s for s in (sock, unix_sock) if s is not None])
+    context = multiprocessing.get_context('fork')
+    processes = [
+        context.Process(
+            target=serve_worker, args=(cluster, worker_idx, engine, sock, unix_sock),
+            name='Worker-{}'.format(worker_idx)
+        ) for worker_idx in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    cluster.close_channels()
+
+    def drain(*_):
+        running_games = [game['name'] for game in cluster.get_all_active_games() if game['state'] == GameState.RUN]
+        start_successor(sock, unix_sock, drained_games=running_games)
+        for worker in processes:
+            os.kill(worker.pid, signal.SIGUSR2)
+    signal.signal(signal.SIGUSR2, drain)
+
+    log.info('Serving on {}, workers: {}'.format(sock.getsockname(), workers))
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        log.warn('Server stopped by keyboard interrupt, waiting for workers...')
+        for process in processes:
+            process.terminate()
+            process.join()
+    finally:
+        cluster.close()
+        sock.close()
+        if unix_sock is not None:
+            unix_sock.close()
+
+
+@task
+def run_server(_, address=CONFIG.SERVER_ADDR, port=CONFIG.SERVER_PORT, log_level='INFO',
+               engine=CONFIG.SERVER_ENGINE, workers=CONFIG.SERVER_WORKERS, unix_socket=CONFIG.SERVER_UNIX_SOCKET):
+    """ Launches 'WG Forge' TCP server.
+    Local clients can connect to the unix domain socket (if its path is given), which is served along with TCP.
+    Engine 'threading' serves each connection by its own thread, 'asyncio' serves all connections by one event loop.
+    Several workers (processes) can be started, each game is served by one of them.
+    On SIGUSR2 the server is restarted without downtime: new server process takes over the listening socket,
+    the old one lets running games finish and exits.
+    """
+    log.setLevel(log_level)
+    if engine not in SERVER_ENGINES:
+        raise ValueError('Unknown server engine: \'{}\', available: {}'.format(engine, ', '.join(SERVER_ENGINES)))
+    try:
+        set_drained_games()
+        sock = get_inherited_socket()
+        unix_sock = get_inherited_socket('SERVER_UNIX_LISTEN_FD')
+        if unix_sock is None and unix_socket:
+            unix_sock = bind_unix_socket(unix_socket)
+        if workers > 1:
+            serve_cluster((address, port), engine, workers, sock=sock, unix_sock=unix_sock)
+        else:
+            serve(SERVER_ENGINES[engine]((address, port), sock=sock, unix_sock=unix_sock))
+    finally:
+        if log.is_queued:
+            log.stop()
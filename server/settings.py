@@ -4,6 +4,7 @@ from os import getenv, path
 
 from attrdict import AttrDict
 
+from defs import Action
 from entity.event import EventType
 
 
@@ -11,6 +12,11 @@ class BaseConfig(object):
     SRC_DIR = path.dirname(path.realpath(__file__))
     SERVER_ADDR = getenv('SERVER_ADDR', '127.0.0.1')
     SERVER_PORT = int(getenv('SERVER_PORT', 2000))
+    SERVER_ENGINE = getenv('SERVER_ENGINE', 'threading')
+    SERVER_WORKERS = int(getenv('SERVER_WORKERS', 1))
+    SERVER_UNIX_SOCKET = getenv('SERVER_UNIX_SOCKET')  # Path of unix domain socket for local clients.
+    ASYNC_EXECUTOR_WORKERS = 32
+    LISTEN_BACKLOG = 128
 
     DB_USER = getenv('DB_USER', 'postgres')
     DB_PASSWORD = getenv('DB_PASSWORD', 'password')
@@ -24,7 +30,33 @@ class BaseConfig(object):
     ACTION_HEADER = 4
     RESULT_HEADER = 4
     MSGLEN_HEADER = 4
+    REQUEST_ID_HEADER = 4
+    SESSION_ID_HEADER = 4
+    CODE_MASK = 0xFFFF  # Action and result codes are sent in low bits, their flags are sent in high bits.
     RECEIVE_CHUNK_SIZE = 1024
+    MAX_FRAME_SIZE = 1024 * 1024  # Larger commands are rejected, the connection is closed.
+    STREAMING_DECODE_THRESHOLD = 64 * 1024  # Larger messages are decoded while they are received.
+    COMPRESSION_THRESHOLD = 1024
+    COMPRESSION_LEVEL = 6
+    MAX_CONNECTIONS = 1000
+    MAX_CONNECTION_SESSIONS = 100  # Player sessions multiplexed over one connection.
+    RESUME_TOKEN_BYTES = 16
+    # Rate limits of each connection (commands per second, burst size), None - not limited:
+    RATE_LIMIT = (500, 1000)
+    ACTION_RATE_LIMITS = {
+        Action.MAP: (100, 200),
+    }
+    MAX_OUTPUT_SIZE = 4 * 1024 * 1024  # Clients which do not read responses are disconnected.
+    MAX_PENDING_REQUESTS = 1000  # Reading of the connection is paused while so many received commands wait.
+    CLOSE_FLUSH_TIMEOUT = 5  # Time to send pending output before the connection is closed.
+    IDLE_TIMEOUT = 5 * 60  # Connections which neither receive nor send data are closed.
+    READ_TIMEOUT = 30  # Connections which do not complete started command are closed.
+    WRITE_TIMEOUT = 30  # Connections which are not able to send pending output are closed.
+    REAPER_PERIOD = 1
+    METRICS_LOG_PERIOD = 60  # Server metrics are logged by the connections reaper, if they are changed.
+    DRAIN_TIMEOUT = 60 * 60  # Games which are still running after draining time are stopped.
+    DRAIN_CHECK_PERIOD = 1
+    MAX_CHANGES_TICKS = 100  # Changes of map layer 1 since older ticks are answered by the whole layer.
 
     HIDDEN_COMMANDS = {}
     HIDDEN_MAP_LAYERS = {}
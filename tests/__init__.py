@@ -6,4 +6,13 @@ Run tests:
 Run some test(s):
     SERVER_CONFIG=testing python -m unittest tests.multiplay.TestMultiplay.test_four_players
     SERVER_CONFIG=testing python -m unittest tests.multiplay
+
+Measure MOVE throughput of running server:
+    SERVER_CONFIG=testing python -m tests.move_benchmark
+
+Measure serialization of map layer 1:
+    SERVER_CONFIG=testing python -m tests.serialization_benchmark
+
+Measure memory allocated for games:
+    SERVER_CONFIG=testing python -m tests.memory_benchmark
 """
@@ -0,0 +1,84 @@
+""" Tests for action BATCH.
+"""
+
+from server.db import map_db
+from server.db.models import Action as ActionModel
+from server.db.session import session_ctx
+from server.defs import Action, Result
+from tests.lib.base_test import BaseTest
+
+
+class TestBatch(BaseTest):
+
+    MAP_NAME = 'test01'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        map_db.generate_maps(map_names=[cls.MAP_NAME, ], active_map=cls.MAP_NAME)
+
+    def setUp(self):
+        super().setUp()
+        self.player = self.login()
+
+    def tearDown(self):
+        self.logout()
+        super().tearDown()
+
+    def get_batch_actions(self):
+        with session_ctx() as db:
+            return [
+                action.message for action in db.query(
+                    ActionModel
+                ).filter(
+                    ActionModel.player_id == self.player['idx'], ActionModel.code == Action.BATCH
+                ).all()
+            ]
+
+    def test_batch_move(self):
+        train_1 = self.player['trains'][0]
+        train_2 = self.player['trains'][1]
+        line_idx = 18
+        non_existing_train_idx = 999999
+        move_1 = {'train_idx': train_1['idx'], 'line_idx': line_idx, 'speed': -1}
+        move_2 = {'train_idx': train_2['idx'], 'line_idx': train_2['line_idx'], 'speed': 0}
+        bad_move = {'train_idx': non_existing_train_idx, 'line_idx': line_idx, 'speed': -1}
+
+        message = self.batch(((Action.MOVE, move_1), (Action.MOVE, bad_move), (Action.MOVE, move_2)))
+        results = message['results']
+        self.assertEqual(
+            [Result.OKEY, Result.RESOURCE_NOT_FOUND, Result.OKEY],
+            [item['result'] for item in results]
+        )
+        self.assertIn('Train index not found', results[1]['error'])
+        self.turn()
+
+        train_1 = self.get_train(train_1['idx'])
+        self.assertEqual(train_1['line_idx'], line_idx)
+        self.assertEqual(train_1['speed'], -1)
+        train_2 = self.get_train(train_2['idx'])
+        self.assertEqual(train_2['speed'], 0)
+
+        # Only applied commands are recorded, all of them by one action:
+        self.assertEqual(
+            [{'actions': [{'action': Action.MOVE, 'data': move_1}, {'action': Action.MOVE, 'data': move_2}]}],
+            self.get_batch_actions()
+        )
+
+    def test_batch_errors(self):
+        non_existing_post_idx = 999999
+        message = self.batch((
+            (Action.TURN, {}),
+            (Action.MOVE, {'train_idx': 1}),
+            (Action.UPGRADE, {'posts': [non_existing_post_idx]}),
+            ([Action.MOVE], {}),
+            (Action.UPGRADE, {'posts': 5}),
+            (Action.UPGRADE, {'trains': [[1]]}),
+        ))
+        self.assertEqual(
+            [Result.BAD_COMMAND, Result.BAD_COMMAND, Result.RESOURCE_NOT_FOUND] + [Result.BAD_COMMAND] * 3,
+            [item['result'] for item in message['results']]
+        )
+        self.assertEqual([], self.get_batch_actions())
+        message = self.do_action(Action.BATCH, {'actions': {}}, exp_result=Result.BAD_COMMAND)
+        self.assertIsNotNone(message)
@@ -0,0 +1,82 @@
+""" Tests for restart of the server (draining on SIGUSR2).
+"""
+
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+from server.config import CONFIG
+from server.db import map_db
+from server.defs import Action, Result
+from tests.lib.base_test import BaseTest
+from tests.lib.server_connection import ServerConnection
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'server')
+
+
+class TestDrain(BaseTest):
+    """ The server is restarted, so the tests use their own server process.
+    """
+
+    MAP_NAME = 'test01'
+    SERVER_PORT = CONFIG.SERVER_PORT + 1
+    START_TIMEOUT = 10
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        map_db.generate_maps(map_names=[cls.MAP_NAME, ], active_map=cls.MAP_NAME)
+        env = dict(os.environ, SERVER_PORT=str(cls.SERVER_PORT))
+        env.pop('SERVER_UNIX_SOCKET', None)
+        # The successor server process is started in the same process group:
+        cls.server = subprocess.Popen(
+            [sys.executable, '-m', 'invoke', 'run-server', '-l', 'WARNING'], cwd=SERVER_DIR, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True
+        )
+        deadline = time.monotonic() + cls.START_TIMEOUT
+        while True:
+            try:
+                socket.create_connection((CONFIG.SERVER_ADDR, cls.SERVER_PORT)).close()
+                break
+            except ConnectionRefusedError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.killpg(cls.server.pid, signal.SIGTERM)
+        cls.server.wait()
+        super().tearDownClass()
+
+    def test_reconnect_to_running_game(self):
+        connection = ServerConnection(port=self.SERVER_PORT)
+        player = self.login(game=self.game_name, num_players=1, resumable=True, connection=connection)
+        self.turn(connection=connection)
+
+        os.kill(self.server.pid, signal.SIGUSR2)
+        time.sleep(1)  # The old server process stops accepting connections.
+
+        # New connections are accepted by the successor, the running game can't be joined there:
+        new_connection = ServerConnection(port=self.SERVER_PORT)
+        _, message = self.do_action(
+            Action.RESUME, {'game': self.game_name, 'token': player['resume_token']}, connection=new_connection,
+            exp_result=Result.ACCESS_DENIED
+        )
+        self.assertIn('previous server process', json.loads(message)['error'])
+        message = self.login(game=self.game_name, num_players=1, connection=new_connection,
+                             exp_result=Result.ACCESS_DENIED)
+        self.assertIn('previous server process', message['error'])
+        # New games are started by the successor:
+        self.login(name='NEW_{}'.format(self.player_name), connection=new_connection)
+        self.logout(connection=new_connection)
+        new_connection.close()
+
+        # The game is played on the old server process until it is finished:
+        self.turn(connection=connection)
+        self.logout(connection=connection)
+        connection.close()
@@ -3,7 +3,9 @@
 
 import json
 
+from server.config import CONFIG
 from server.db import map_db
+from server.entity.game import Game
 from server.entity.map import Map
 from server.entity.player import Player
 from server.entity.point import Point
@@ -79,6 +81,97 @@ class TestEntity(BaseTest):
         self.assertIn('size', data)
         self.assertIn('coordinates', data)
 
+    def test_compiled_encoders(self):
+        """ Test objects are encoded by compiled encoders without protected attributes and without sharing of state.
+        """
+        player = Player(self.player_name, password='secret')
+        player.add_train(Train(idx=1, line_idx=1, position=0))
+        data = json.loads(player.to_json_str())
+        self.assertNotIn('password', data)
+        self.assertEqual([1], [train['idx'] for train in data['trains']])
+        point = Point(idx=1, post_idx=1)
+        point_dict = Point.default_serializer(point)
+        point_dict['extra'] = True
+        self.assertEqual({'idx': 1, 'post_idx': 1}, Point.default_serializer(point))
+        self.assertFalse(hasattr(point, '__dict__'))
+        town = Post(1, 'town', PostType.TOWN, population=1, point_idx=1)
+        market = Post(2, 'market', PostType.MARKET, product=5, replenishment=1, point_idx=2)
+        self.assertNotIn('replenishment', Post.default_serializer(town))
+        self.assertFalse(hasattr(town, '__dict__') or hasattr(market, '__dict__'))
+        self.assertEqual(1, Post.default_serializer(town)['population'])
+        self.assertEqual(
+            {'idx': 2, 'name': 'market', 'type': PostType.MARKET, 'point_idx': 2, 'events': [], 'product': 5,
+             'product_capacity': 5, 'replenishment': 1},
+            Post.default_serializer(market)
+        )
+        self.assertEqual({'idx': 1}, Point.default_serializer(point, attributes={'idx'}))
+
+    def test_static_layers_cache(self):
+        """ Test static map layers are serialized once for all instances of the map.
+        """
+        game_map, other_map = Map(self.MAP_NAME), Map(self.MAP_NAME)
+        for layer in Map.STATIC_LAYERS:
+            message = game_map.serialize_layer(layer)
+            self.assertIsInstance(message, bytes)
+            self.assertIs(message, other_map.serialize_layer(layer))
+            self.assertEqual(json.loads(game_map.layer_to_json_str(layer)), json.loads(message))
+            self.assertIs(game_map.serialize_layer(layer, compression=True),
+                          other_map.serialize_layer(layer, compression=True))
+
+    def test_game_map_layer_cache(self):
+        """ Test dynamic map layer is serialized once for each version of the game state.
+        """
+        game = Game(self.game_name, observed=True, map_name=self.MAP_NAME, num_players=1)
+        player = game.add_player(Player(self.player_name))
+        train = list(player.trains.values())[0]
+        layer_1 = game.get_map_layer(player, 1)
+        self.assertIs(layer_1, game.get_map_layer(player, 1))
+
+        game.move_train(player, train.idx, 1, train.line_idx)
+        layer_1 = game.get_map_layer(player, 1)
+        self.assertEqual(1, json.loads(layer_1)['trains'][0]['speed'])
+        self.assertIs(layer_1, game.get_map_layer(player, 1))
+
+        game.tick()
+        self.assertEqual(1, json.loads(game.get_map_layer(player, 1))['trains'][0]['position'])
+        game.delete()
+
+    def test_game_layer_changes_window(self):
+        """ Test changes since ticks which are not stamped are answered by the whole map layer.
+        """
+        game = Game(self.game_name, observed=True, map_name=self.MAP_NAME, num_players=1)
+        player = game.add_player(Player(self.player_name))
+        game.tick()
+        # Changes are stamped since the first request:
+        changes = json.loads(game.get_map_layer(player, 1, since_tick=1))
+        self.assertTrue(changes['full'])
+        self.assertEqual(len(game.map.trains), len(changes['trains']))
+        game.tick()
+        changes = json.loads(game.get_map_layer(player, 1, since_tick=2))
+        self.assertFalse(changes['full'])
+        self.assertEqual([], changes['trains'])
+        for _ in range(CONFIG.MAX_CHANGES_TICKS):
+            game.tick()
+        changes = json.loads(game.get_map_layer(player, 1, since_tick=2))
+        self.assertTrue(changes['full'])
+        self.assertEqual(len(game.map.trains), len(changes['trains']))
+        self.assertFalse(json.loads(game.get_map_layer(player, 1, since_tick=game.current_tick))['full'])
+        game.delete()
+
+    def test_tick_notifications_sharing(self):
+        """ Test tick notification is serialized once per tick for all subscribers.
+        """
+        game = Game(self.game_name, observed=True, map_name=self.MAP_NAME, num_players=1)
+        player = game.add_player(Player(self.player_name))
+        game.tick()
+        notification = game.get_tick_notification(player, 1)
+        self.assertIs(notification, game.get_tick_notification(player, 1))
+        self.assertEqual(1, json.loads(notification)['tick'])
+        self.assertIsNot(notification, game.get_tick_notification(player, 0))
+        game.tick()
+        self.assertEqual(2, json.loads(game.get_tick_notification(player, 1))['tick'])
+        game.delete()
+
     def test_player_init(self):
         """ Test create player entity.
         """
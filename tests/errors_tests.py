@@ -1,8 +1,10 @@
 """ Tests for server errors.
 """
 
+import json
+
 from server.db import map_db
-from server.defs import Result
+from server.defs import Action, Result
 from tests.lib.base_test import BaseTest
 
 
@@ -76,6 +78,20 @@ class TestErrors(BaseTest):
         self.assertIn('error', message)
         self.assertIn('The train is not able to switch the current line to the next line', message['error'])
 
+    def test_malformed_move(self):
+        # Login is checked before the payload:
+        message = self.move_train(1, True, 1, exp_result=Result.ACCESS_DENIED)
+        self.assertIn('Login required', message['error'])
+        player = self.login()
+        train_idx = player['trains'][0]['idx']
+        for payload, error in (
+            ({'train_idx': train_idx, 'line_idx': 1}, 'does not contain all needed keys'),
+            ({'train_idx': str(train_idx), 'line_idx': 1, 'speed': 1}, 'payload key \'train_idx\' is not int'),
+            ({'train_idx': train_idx, 'line_idx': 1, 'speed': True}, 'payload key \'speed\' is not int'),
+        ):
+            _, message = self.do_action(Action.MOVE, payload, exp_result=Result.BAD_COMMAND)
+            self.assertIn(error, json.loads(message)['error'])
+
     def test_upgrade(self):
         non_existing_post_idx = 999999
         non_town_post_idx = 5
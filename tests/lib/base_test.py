@@ -79,8 +79,8 @@ class BaseTest(unittest.TestCase):
         return result, message
 
     def login(
-            self, name=None, game=None, password=None, num_players=None, num_turns=None,
-            exp_result=Result.OKEY, **kwargs
+            self, name=None, game=None, password=None, num_players=None, num_turns=None, encoding=None,
+            compression=None, resumable=None, exp_result=Result.OKEY, **kwargs
     ):
         message = {'name': self.player_name if name is None else name}
         if game is not None:
@@ -91,6 +91,12 @@ class BaseTest(unittest.TestCase):
             message['num_players'] = num_players
         if num_turns is not None:
             message['num_turns'] = num_turns
+        if encoding is not None:
+            message['encoding'] = encoding
+        if compression is not None:
+            message['compression'] = compression
+        if resumable is not None:
+            message['resumable'] = resumable
         _, message = self.do_action(
             Action.LOGIN,
             message,
@@ -119,10 +125,13 @@ class BaseTest(unittest.TestCase):
                 self.current_tick += 1
         return json.loads(message) if message else None
 
-    def get_map(self, layer, exp_result=Result.OKEY, **kwargs):
+    def get_map(self, layer, exp_result=Result.OKEY, since_tick=None, **kwargs):
+        data = {'layer': layer}
+        if since_tick is not None:
+            data['since_tick'] = since_tick
         _, message = self.do_action(
             Action.MAP,
-            {'layer': layer},
+            data,
             exp_result=exp_result,
             **kwargs
         )
@@ -242,6 +251,17 @@ class BaseTest(unittest.TestCase):
         )
         return json.loads(message) if message else None
 
+    def batch(self, actions, exp_result=Result.OKEY, **kwargs):
+        _, message = self.do_action(
+            Action.BATCH,
+            {
+                'actions': [{'action': action, 'data': data} for action, data in actions],
+            },
+            exp_result=exp_result,
+            **kwargs
+        )
+        return json.loads(message) if message else None
+
     def get_player(self, exp_result=Result.OKEY, **kwargs):
         _, message = self.do_action(
             Action.PLAYER,
@@ -1,9 +1,10 @@
-""" TCP client connection.
+""" TCP (or unix domain socket) client connection.
 """
 import json
 import socket
+import zlib
 
-from server.defs import Result
+from server.defs import ActionFlag, Encoding, Result, ResultFlag
 from server.config import CONFIG
 
 
@@ -11,15 +12,27 @@ class ServerConnection(object):
     """ Connection object.
     """
 
-    def __init__(self, host=CONFIG.SERVER_ADDR, port=CONFIG.SERVER_PORT):
+    def __init__(self, host=CONFIG.SERVER_ADDR, port=CONFIG.SERVER_PORT, unix_socket=None):
         self.host = host
         self.port = port
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        if self.host and self.port:
+        self.unix_socket = unix_socket
+        self.encoding = Encoding.JSON
+        self.last_flags = ResultFlag(0)
+        self.last_request_id = None
+        self.last_session_id = None
+        if self.unix_socket:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
             self.connect()
+        else:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            if self.host and self.port:
+                self.connect()
 
     def connect(self):
-        self.sock.connect((self.host, self.port))
+        if self.unix_socket:
+            self.sock.connect(self.unix_socket)
+        else:
+            self.sock.connect((self.host, self.port))
 
     def close(self):
         self.sock.close()
@@ -44,31 +57,71 @@ class ServerConnection(object):
             bytes_recd += len(chunk)
         return b''.join(chunks)
 
-    def send_action(self, action: int, data='', is_raw=False, wait_for_response=True):
-        """ Sends action command.
+    @staticmethod
+    def encode_action(action: int, data='', is_raw=False, request_id=None, session_id=None):
+        """ Returns action command as bytes.
         """
-        self.send(action.to_bytes(CONFIG.ACTION_HEADER, byteorder='little'))
         if is_raw or not data:
             message = data
         else:
             message = json.dumps(data, sort_keys=True, indent=4)
-        self.send(len(message).to_bytes(CONFIG.MSGLEN_HEADER, byteorder='little'))
-        self.send(message.encode('utf-8'))
+        message = message.encode('utf-8')
+        flags = ActionFlag(0)
+        ids = b''
+        if request_id is not None:
+            flags |= ActionFlag.REQUEST_ID
+            ids += request_id.to_bytes(CONFIG.REQUEST_ID_HEADER, byteorder='little')
+        if session_id is not None:
+            flags |= ActionFlag.SESSION_ID
+            ids += session_id.to_bytes(CONFIG.SESSION_ID_HEADER, byteorder='little')
+        return (
+            (action | flags).to_bytes(CONFIG.ACTION_HEADER, byteorder='little') + ids +
+            len(message).to_bytes(CONFIG.MSGLEN_HEADER, byteorder='little') + message
+        )
+
+    def send_action(self, action: int, data='', is_raw=False, wait_for_response=True, request_id=None,
+                    session_id=None):
+        """ Sends action command.
+        """
+        self.send(self.encode_action(action, data, is_raw=is_raw, request_id=request_id, session_id=session_id))
 
         if wait_for_response:
             return self.read_response()
         else:
             return None, None
 
+    def send_actions(self, actions, wait_for_response=True):
+        """ Sends several action commands at once (pipelining), actions: sequence of (action, data) pairs.
+        """
+        self.send(b''.join([self.encode_action(action, data) for action, data in actions]))
+
+        if wait_for_response:
+            return [self.read_response() for _ in actions]
+        else:
+            return None
+
     def read_response(self):
-        """ Returns action result with message as string.
+        """ Returns action result with message as string (as bytes for binary encoding).
         """
         data = self.receive(CONFIG.RESULT_HEADER)
-        result = Result(int.from_bytes(data[:CONFIG.RESULT_HEADER], byteorder='little'))
+        result = int.from_bytes(data[:CONFIG.RESULT_HEADER], byteorder='little')
+        self.last_flags = ResultFlag(result & ~CONFIG.CODE_MASK)
+        result = Result(result & CONFIG.CODE_MASK)
+        self.last_request_id = self.last_session_id = None
+        if ResultFlag.REQUEST_ID in self.last_flags:
+            data = self.receive(CONFIG.REQUEST_ID_HEADER)
+            self.last_request_id = int.from_bytes(data, byteorder='little')
+        if ResultFlag.SESSION_ID in self.last_flags:
+            data = self.receive(CONFIG.SESSION_ID_HEADER)
+            self.last_session_id = int.from_bytes(data, byteorder='little')
         data = self.receive(CONFIG.MSGLEN_HEADER)
         msg_len = int.from_bytes(data[:CONFIG.MSGLEN_HEADER], byteorder='little')
         message = ''
         if msg_len != 0:
             data = self.receive(msg_len)
-            message = data[:msg_len].decode('utf-8')
+            message = data[:msg_len]
+            if ResultFlag.COMPRESSED in self.last_flags:
+                message = zlib.decompress(message)
+            if self.encoding != Encoding.MSGPACK:
+                message = message.decode('utf-8')
         return result, message
@@ -1,9 +1,11 @@
 """ Tests for action LOGIN.
 """
 
+import json
+
 from server.config import CONFIG
 from server.db import map_db
-from server.defs import Result
+from server.defs import Action, Result
 from tests.lib.base_test import BaseTest
 from tests.lib.server_connection import ServerConnection
 
@@ -184,3 +186,53 @@ class TestLogin(BaseTest):
 
         conn1.close()
         conn2.close()
+
+    def test_disconnect_and_resume(self):
+        # Second player to keep game alive after disconnect
+        player_2 = 'PLAYER_2_{}_{}'.format(self.id(), self.test_start)
+        player_2_conn = ServerConnection()
+        num_players = 2
+
+        self.login(game=self.game_name, name=player_2, connection=player_2_conn, num_players=num_players)
+        player = self.login(game=self.game_name, num_players=num_players, resumable=True)
+        self.assertIsNotNone(player['resume_token'])
+        self.assertNotIn('resume_token', self.get_player())
+        self.players_turn([self.connection, player_2_conn])
+
+        # Disconnect
+        self.reset_connection()
+
+        _, message = self.do_action(
+            Action.RESUME, {'game': self.game_name, 'token': player['resume_token']}, exp_result=Result.OKEY
+        )
+        resume = json.loads(message)
+        self.assertEqual({'idx': player['idx'], 'tick': 1}, {'idx': resume['idx'], 'tick': resume['tick']})
+        self.assertNotEqual(player['resume_token'], resume['resume_token'])
+        self.assertEqual(player['idx'], self.get_player()['idx'])
+        self.players_turn([self.connection, player_2_conn])
+
+        # Only token of the game is valid:
+        connection = ServerConnection()
+        self.do_action(
+            Action.RESUME, {'game': self.game_name, 'token': 'not a token'}, connection=connection,
+            exp_result=Result.ACCESS_DENIED
+        )
+        self.do_action(
+            Action.RESUME, {'game': 'NOT_{}'.format(self.game_name), 'token': resume['resume_token']},
+            connection=connection, exp_result=Result.ACCESS_DENIED
+        )
+        # The token is replaced by RESUME:
+        self.do_action(
+            Action.RESUME, {'game': self.game_name, 'token': player['resume_token']}, connection=connection,
+            exp_result=Result.ACCESS_DENIED
+        )
+        connection.close()
+
+        self.logout()
+        # The token is not valid after LOGOUT:
+        self.reset_connection()
+        self.do_action(
+            Action.RESUME, {'game': self.game_name, 'token': resume['resume_token']}, exp_result=Result.ACCESS_DENIED
+        )
+        self.logout(connection=player_2_conn)
+        player_2_conn.close()
@@ -0,0 +1,66 @@
+""" Tests for changes of map layer 1 since the tick.
+"""
+
+from server.db import map_db
+from server.defs import Result
+from tests.lib.base_test import BaseTest
+
+
+class TestMapChanges(BaseTest):
+
+    MAP_NAME = 'test01'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        map_db.generate_maps(map_names=[cls.MAP_NAME, ], active_map=cls.MAP_NAME)
+
+    def setUp(self):
+        super().setUp()
+        self.player = self.login()
+
+    def tearDown(self):
+        self.logout()
+        super().tearDown()
+
+    def test_changes_since_start(self):
+        layer = self.get_map(1)
+        changes = self.get_map(1, since_tick=0)
+        self.assertEqual(changes['tick'], 0)
+        self.assertEqual(changes['idx'], layer['idx'])
+        self.assertEqual(changes['posts'], layer['posts'])
+        self.assertEqual(changes['trains'], layer['trains'])
+        self.assertEqual(changes['ratings'], layer['ratings'])
+        self.assertEqual(changes['removed'], {'posts': [], 'trains': [], 'ratings': []})
+        self.assertTrue(changes['full'])
+
+    def test_changes_since_tick(self):
+        train = self.player['trains'][0]
+        town_idx = self.player['town']['idx']
+        # Changes are tracked since the first request:
+        self.assertTrue(self.get_map(1, since_tick=0)['full'])
+        self.turn()
+
+        changes = self.get_map(1, since_tick=1)
+        self.assertFalse(changes['full'])
+        self.assertEqual(changes['tick'], 1)
+        self.assertEqual(changes['trains'], [])
+        self.assertEqual(changes['posts'], [])
+
+        self.move_train(18, train['idx'], -1)
+        changes = self.get_map(1, since_tick=1)
+        self.assertEqual([t['idx'] for t in changes['trains']], [train['idx']])
+        self.assertEqual(changes['trains'][0]['speed'], -1)
+        self.assertEqual(changes['posts'], [])
+
+        self.turn()
+        changes = self.get_map(1, since_tick=1)
+        self.assertEqual(changes['tick'], 2)
+        self.assertEqual(changes['trains'], [self.get_train(train['idx'])])
+        self.assertIn(town_idx, [p['idx'] for p in changes['posts']])
+        self.assertEqual(self.get_map(1, since_tick=2)['trains'], [])
+
+    def test_invalid_since_tick(self):
+        for since_tick in (1, -1, '0', 0.5):
+            self.get_map(1, since_tick=since_tick, exp_result=Result.BAD_COMMAND)
+        self.get_map(0, since_tick=0, exp_result=Result.BAD_COMMAND)
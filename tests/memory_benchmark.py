@@ -0,0 +1,60 @@
+""" Memory allocated for games with all their entities.
+
+Run (the map is re-generated in the DB):
+    SERVER_CONFIG=testing python -m tests.memory_benchmark --map map04 --games 20
+"""
+
+import argparse
+import sys
+import tracemalloc
+
+from server.db import map_db
+from server.entity.game import Game
+from server.entity.map import Map
+from server.entity.player import Player
+
+
+def get_entities_size(game):
+    """ Returns memory used by the game's entities (not including memory of their attribute values).
+    """
+    game_map = game.map
+    entities = [
+        *game_map.points.values(), *game_map.lines.values(), *game_map.posts.values(), *game_map.trains.values(),
+        *game.players.values(),
+    ]
+    return sum(
+        sys.getsizeof(entity) + (sys.getsizeof(entity.__dict__) if hasattr(entity, '__dict__') else 0)
+        for entity in entities
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures memory allocated for games.')
+    parser.add_argument('--map', default='map04', help='name of the map')
+    parser.add_argument('--games', type=int, default=20, help='number of games')
+    args = parser.parse_args()
+
+    map_db.generate_maps(map_names=[args.map, ])
+    num_players = len(Map(name=args.map).towns)
+
+    games = []
+    tracemalloc.start()
+    started = tracemalloc.take_snapshot()
+    for game_number in range(args.games):
+        game = Game('BENCHMARK_{}'.format(game_number), observed=True, map_name=args.map, num_players=num_players)
+        for i in range(num_players):
+            game.add_player(Player('BENCHMARK_{}'.format(i), idx=i + 1))
+        games.append(game)
+    finished = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    total_size = sum(stat.size_diff for stat in finished.compare_to(started, 'filename'))
+    print('Map {}, {} players: {:.1f} KB per game, entities: {:.1f} KB per game'.format(
+        args.map, num_players, total_size / 1024 / args.games, get_entities_size(games[0]) / 1024))
+
+    for game in games:
+        game.delete()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+""" Throughput of MOVE commands: valid ones and malformed ones, which are rejected by payload validation.
+
+Run against running server (started with testing config, so commands are not throttled):
+    SERVER_CONFIG=testing python -m tests.move_benchmark --count 10000 --rounds 5
+"""
+
+import argparse
+import json
+import time
+from datetime import datetime
+
+from server.defs import Action, Result
+from tests.lib.server_connection import ServerConnection
+
+
+def measure(connection, actions, rounds):
+    """ Sends the actions pipelined in each round.
+    returns: average and best number of commands per second, results of the commands
+    """
+    rates, results = [], set()
+    for _ in range(rounds):
+        started = time.perf_counter()
+        responses = connection.send_actions(actions)
+        rates.append(len(actions) / (time.perf_counter() - started))
+        results.update(Result(result).name for result, _ in responses)
+    return sum(rates) / len(rates), max(rates), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures throughput of MOVE commands.')
+    parser.add_argument('--count', type=int, default=10000, help='number of commands in each round')
+    parser.add_argument('--rounds', type=int, default=5, help='number of rounds')
+    args = parser.parse_args()
+
+    connection = ServerConnection()
+    name = 'BENCHMARK_{}'.format(datetime.now().strftime('%H:%M:%S.%f'))
+    _, message = connection.send_action(Action.LOGIN, {'name': name, 'game': name})
+    train = json.loads(message)['trains'][0]
+    move = {'train_idx': train['idx'], 'line_idx': train['line_idx'], 'speed': 0}
+    malformed_moves = (
+        {'train_idx': train['idx'], 'line_idx': train['line_idx']},
+        {'train_idx': str(train['idx']), 'line_idx': train['line_idx'], 'speed': 0},
+    )
+
+    for title, actions in (
+        ('Valid MOVE', [(Action.MOVE, move)] * args.count),
+        ('Malformed MOVE', [(Action.MOVE, malformed_moves[i % 2]) for i in range(args.count)]),
+    ):
+        average, best, results = measure(connection, actions, args.rounds)
+        print('{}: {:.0f} commands/s, best: {:.0f} commands/s, results: {}'.format(
+            title, average, best, ', '.join(sorted(results))))
+
+    connection.send_action(Action.LOGOUT)
+    connection.close()
+
+
+if __name__ == '__main__':
+    main()
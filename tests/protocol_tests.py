@@ -0,0 +1,297 @@
+""" Tests for wire protocol features.
+"""
+
+import json
+import socket
+import time
+import unittest
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from server.config import CONFIG
+from server.db import map_db
+from server.defs import Action, Encoding, Result, ResultFlag
+from tests.lib.base_test import BaseTest
+from tests.lib.server_connection import ServerConnection
+
+
+class TestProtocol(BaseTest):
+
+    MAP_NAME = 'test01'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        map_db.generate_maps(map_names=[cls.MAP_NAME, ], active_map=cls.MAP_NAME)
+
+    def test_pipelining(self):
+        non_existing_train_idx = 999999
+        responses = self.connection.send_actions((
+            (Action.LOGIN, {'name': self.player_name}),
+            (Action.MAP, {'layer': 0}),
+            (Action.PLAYER, ''),
+            (Action.MOVE, {'train_idx': non_existing_train_idx, 'line_idx': 1, 'speed': 1}),
+            (Action.MAP, {'layer': 1}),
+        ))
+        self.assertEqual(
+            [Result.OKEY, Result.OKEY, Result.OKEY, Result.RESOURCE_NOT_FOUND, Result.OKEY],
+            [result for result, _ in responses]
+        )
+        login, layer_0, player, move, layer_1 = [json.loads(message) for _, message in responses]
+        self.assertEqual(self.player_name, login['name'])
+        self.assertIn('lines', layer_0)
+        self.assertEqual(login['idx'], player['idx'])
+        self.assertIn('error', move)
+        self.assertIn('trains', layer_1)
+
+    def test_pipelining_flood(self):
+        """ Test all commands are executed when reading of the connection is paused and resumed.
+        """
+        count = CONFIG.MAX_PENDING_REQUESTS * 3
+        responses = self.connection.send_actions(
+            [(Action.LOGIN, {'name': self.player_name})] + [(Action.PLAYER, '')] * count
+        )
+        self.assertEqual([Result.OKEY] * (count + 1), [result for result, _ in responses])
+
+    def test_pipelining_after_logout(self):
+        responses = self.connection.send_actions((
+            (Action.LOGIN, {'name': self.player_name}),
+            (Action.LOGOUT, ''),
+            (Action.PLAYER, ''),
+        ), wait_for_response=False)
+        self.assertIsNone(responses)
+        result, _ = self.connection.read_response()
+        self.assertEqual(Result.OKEY, result)
+        result, _ = self.connection.read_response()
+        self.assertEqual(Result.OKEY, result)
+        # Commands after LOGOUT are not processed, connection is closed:
+        self.assertEqual(b'', self.connection.sock.recv(1))
+
+    def test_request_ids(self):
+        player = self.login(game=self.game_name, num_players=2)
+        connection = ServerConnection()
+        self.login(name='{}_2'.format(self.player_name), game=self.game_name, num_players=2, connection=connection)
+        turn_request_id, map_request_id = 1, 2
+        self.connection.send(
+            ServerConnection.encode_action(Action.TURN, request_id=turn_request_id) +
+            ServerConnection.encode_action(Action.MAP, {'layer': 1}, request_id=map_request_id)
+        )
+        # The game tick waits for the second player, MAP is answered before TURN:
+        result, message = self.connection.read_response()
+        self.assertEqual(Result.OKEY, result)
+        self.assertEqual(map_request_id, self.connection.last_request_id)
+        self.assertIn(ResultFlag.REQUEST_ID, self.connection.last_flags)
+        self.assertEqual(player['idx'], json.loads(message)['trains'][0]['player_idx'])
+        self.turn(connection=connection)
+        result, message = self.connection.read_response()
+        self.assertEqual(Result.OKEY, result)
+        self.assertEqual(turn_request_id, self.connection.last_request_id)
+        # Errors have request id too, commands without request id are answered as usual:
+        result, _ = self.connection.send_action(Action.MAP, {'layer': 999999}, request_id=3)
+        self.assertEqual(Result.RESOURCE_NOT_FOUND, result)
+        self.assertEqual(3, self.connection.last_request_id)
+        self.assertIn('lines', self.get_map(0))
+        self.assertIsNone(self.connection.last_request_id)
+        connection.close()
+
+    def test_sessions(self):
+        num_sessions = 3
+        players = {}
+        for session_id in range(1, num_sessions + 1):
+            player = self.login(
+                name='{}_{}'.format(self.player_name, session_id), game='{}_{}'.format(self.game_name, session_id),
+                session_id=session_id, exp_result=None
+            )
+            if 'served by another server process' in player.get('error', ''):
+                self.skipTest('The server has several workers, games are served by different workers')
+            self.assertEqual(session_id, self.connection.last_session_id)
+            players[session_id] = player
+        # Each session is served as separate connection:
+        for session_id, player in players.items():
+            layer_1 = self.get_map(1, session_id=session_id)
+            self.assertEqual(session_id, self.connection.last_session_id)
+            self.assertEqual(player['idx'], layer_1['trains'][0]['player_idx'])
+        # TURN of one session does not block others:
+        self.turn(session_id=1)
+        self.assertEqual(1, self.connection.last_session_id)
+        self.logout(session_id=2)
+        self.get_map(1, session_id=2, exp_result=Result.ACCESS_DENIED)
+        # The connection itself is not logged in:
+        self.get_map(1, exp_result=Result.ACCESS_DENIED)
+        self.assertIsNone(self.connection.last_session_id)
+        self.assertEqual(players[3]['idx'], self.get_player(session_id=3)['idx'])
+
+    def test_rate_limit(self):
+        _, burst = CONFIG.ACTION_RATE_LIMITS[Action.GAMES]
+        responses = self.connection.send_actions([(Action.GAMES, '')] * (burst * 2))
+        results = [result for result, _ in responses]
+        self.assertEqual([Result.OKEY] * burst, results[:burst])
+        self.assertIn(Result.THROTTLED, results[burst:])
+        # Other actions are not limited:
+        self.login()
+        # Tokens are added with time:
+        time.sleep(1)
+        self.assertIn('games', self.get_games())
+
+    def test_compact_json_encoding(self):
+        player = self.login(encoding=Encoding.COMPACT_JSON)
+        self.assertEqual(self.player_name, player['name'])
+        for action, data in ((Action.MAP, {'layer': 1}), (Action.PLAYER, ''), (Action.GAMES, '')):
+            _, message = self.do_action(action, data, exp_result=Result.OKEY)
+            self.assertNotIn('\n', message)
+            self.assertNotIn(': ', message)
+            self.assertIsInstance(json.loads(message), dict)
+        _, message = self.do_action(Action.MAP, {'layer': 999999}, exp_result=Result.RESOURCE_NOT_FOUND)
+        self.assertEqual({'error': 'Map layer not found, layer: 999999'}, json.loads(message))
+
+    @unittest.skipIf(msgpack is None, 'msgpack is not installed')
+    def test_msgpack_encoding(self):
+        self.connection.encoding = Encoding.MSGPACK
+        _, message = self.do_action(
+            Action.LOGIN, {'name': self.player_name, 'encoding': Encoding.MSGPACK}, exp_result=Result.OKEY
+        )
+        player = msgpack.unpackb(message, raw=False)
+        self.assertEqual(self.player_name, player['name'])
+        _, message = self.do_action(Action.MAP, {'layer': 1}, exp_result=Result.OKEY)
+        layer_1 = msgpack.unpackb(message, raw=False)
+        self.assertEqual(player['idx'], layer_1['trains'][0]['player_idx'])
+
+    def test_observer_encoding(self):
+        _, message = self.do_action(Action.OBSERVER, {'encoding': Encoding.COMPACT_JSON}, exp_result=Result.OKEY)
+        self.assertNotIn('\n', message)
+        self.assertIn('games', json.loads(message))
+
+    def test_unknown_encoding(self):
+        message = self.login(encoding=999, exp_result=Result.BAD_COMMAND)
+        self.assertIn('Encoding is not supported', message['error'])
+
+    def test_compression(self):
+        connection = ServerConnection()
+        self.login(name='{}_2'.format(self.player_name), game='{}_2'.format(self.game_name), connection=connection)
+        layer_0 = self.get_map(0, connection=connection)
+        connection.close()
+
+        self.login(compression=True)
+        self.assertEqual(layer_0, self.get_map(0))
+        self.assertIn(ResultFlag.COMPRESSED, self.connection.last_flags)
+        # Compressed static layer is reused:
+        self.assertEqual(layer_0, self.get_map(0))
+        self.assertIn(ResultFlag.COMPRESSED, self.connection.last_flags)
+        # Small responses are not compressed:
+        message = self.get_map(999999, exp_result=Result.RESOURCE_NOT_FOUND)
+        self.assertIn('Map layer not found', message['error'])
+        self.assertNotIn(ResultFlag.COMPRESSED, self.connection.last_flags)
+
+    def test_observer_compression(self):
+        self.do_action(Action.OBSERVER, {'compression': True}, exp_result=Result.OKEY)
+        self.do_action(Action.GAME, {'idx': 999999}, exp_result=Result.RESOURCE_NOT_FOUND)
+        self.assertNotIn(ResultFlag.COMPRESSED, self.connection.last_flags)
+
+    def test_unknown_compression(self):
+        message = self.login(compression='yes', exp_result=Result.BAD_COMMAND)
+        self.assertIn('The compression flag is not a boolean', message['error'])
+
+    def read_turn_with_notification(self):
+        """ Sends TURN and returns the notification about the tick, the notification can come before the response.
+        """
+        self.turn(wait_for_response=False, exp_result=None)
+        notification = None
+        for _ in range(2):
+            result, message = self.connection.read_response()
+            self.assertEqual(Result.OKEY, result)
+            if ResultFlag.NOTIFICATION in self.connection.last_flags:
+                self.assertIsNone(notification)
+                notification = json.loads(message)
+        self.assertIsNotNone(notification)
+        return notification
+
+    def test_subscribe(self):
+        self.login()
+        self.do_action(Action.SUBSCRIBE, exp_result=Result.OKEY)
+        self.assertEqual({'tick': 1}, self.read_turn_with_notification())
+        self.assertEqual({'tick': 2}, self.read_turn_with_notification())
+
+    def test_subscribe_with_map_layer(self):
+        player = self.login()
+        self.do_action(Action.SUBSCRIBE, {'layer': 1}, exp_result=Result.OKEY)
+        notification = self.read_turn_with_notification()
+        self.assertEqual(1, notification['tick'])
+        trains = {train['idx']: train for train in notification['map']['trains']}
+        self.assertIn(player['trains'][0]['idx'], trains)
+        message = self.do_action(Action.SUBSCRIBE, {'layer': 999999}, exp_result=Result.RESOURCE_NOT_FOUND)
+        self.assertIsNotNone(message)
+
+    def test_connections_limit(self):
+        connections = []
+        try:
+            for _ in range(CONFIG.MAX_CONNECTIONS * 10):
+                connection = ServerConnection()
+                connections.append(connection)
+                try:
+                    self.get_games(connection=connection)
+                except ConnectionError:
+                    break
+            else:
+                self.fail('Connections limit is not reached')
+        finally:
+            for connection in connections:
+                connection.close()
+        time.sleep(1)
+        self.assertIn('games', self.get_games())
+
+    def test_slow_consumer(self):
+        connection = ServerConnection(host=None, port=None)
+        connection.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        connection.host, connection.port = CONFIG.SERVER_ADDR, CONFIG.SERVER_PORT
+        connection.connect()
+        self.login(connection=connection)
+        actions = [(Action.MAP, {'layer': 0})] * 1000
+        # The client does not read responses, other clients are served anyway:
+        connection.send_actions(actions, wait_for_response=False)
+        self.login()
+        self.assertIn('lines', self.get_map(0))
+        self.turn()
+        connection.close()
+
+    @unittest.skipIf(CONFIG.SERVER_UNIX_SOCKET is None, 'The server does not listen on unix domain socket')
+    def test_unix_socket(self):
+        connection = ServerConnection(unix_socket=CONFIG.SERVER_UNIX_SOCKET)
+        player = self.login(connection=connection)
+        self.assertIn('lines', self.get_map(0, connection=connection))
+        layer_1 = self.get_map(1, connection=connection)
+        self.assertEqual(player['idx'], layer_1['trains'][0]['player_idx'])
+        self.turn(connection=connection)
+        connection.close()
+
+    def test_read_timeout(self):
+        self.login()
+        # Not completed command:
+        self.connection.send(ServerConnection.encode_action(Action.MAP, {'layer': 0})[:-1])
+        time.sleep(CONFIG.READ_TIMEOUT + 2)
+        self.assertEqual(b'', self.connection.sock.recv(1))
+
+    def test_large_command(self):
+        self.login()
+        # Multi-byte characters are split between received chunks:
+        padding = 'ж' * CONFIG.STREAMING_DECODE_THRESHOLD
+        layer_0 = self.get_map(0)
+        result, message = self.connection.send_action(
+            Action.MAP, json.dumps({'layer': 0, 'padding': padding}, ensure_ascii=False), is_raw=True
+        )
+        self.assertEqual(Result.OKEY, result)
+        self.assertEqual(layer_0, json.loads(message))
+        self.assertEqual(layer_0, self.get_map(0))
+
+    def test_too_large_command(self):
+        self.login()
+        # Only the header is sent, the server rejects the command without waiting for its data:
+        header = Action.MAP.to_bytes(CONFIG.ACTION_HEADER, byteorder='little')
+        header += (CONFIG.MAX_FRAME_SIZE + 1).to_bytes(CONFIG.MSGLEN_HEADER, byteorder='little')
+        self.connection.send(header)
+        result, message = self.connection.read_response()
+        self.assertEqual(Result.BAD_COMMAND, result)
+        self.assertIn('The command exceeds maximum frame size', json.loads(message)['error'])
+        self.assertEqual(b'', self.connection.sock.recv(1))
@@ -0,0 +1,154 @@
+""" Serialization of map layer 1 by compiled encoders compared with generic serializer used before them.
+Both are measured on copies of the entities keeping attributes in __dict__ (as entities did before __slots__ were
+declared), and compiled encoders are measured on the game's entities with __slots__ too. The game's entities are also
+encoded by the tuple of their fields (fetched by operator.attrgetter), the alternative to compiled encoders of
+entities with __slots__.
+
+Run (the map is re-generated in the DB):
+    SERVER_CONFIG=testing python -m tests.serialization_benchmark --map map04 --number 200
+"""
+
+import argparse
+import json
+import operator
+import timeit
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from server.db import map_db
+from server.defs import Encoding
+from server.entity.game import Game
+from server.entity.map import Map
+from server.entity.player import Player
+from server.entity.serializable import Message, get_fields
+
+DICT_ENTITY_CLASSES = {}
+FIELDS_SERIALIZERS = {}
+
+
+def generic_serializer(obj, attributes=None):
+    """ Serializer of objects to dictionaries which was used before compiled encoders.
+    """
+    obj_dict = obj.__dict__.copy()
+
+    if hasattr(obj, 'PROTECTED'):
+        for attr in obj.PROTECTED:
+            obj_dict.pop(attr, None)
+
+    if attributes:
+        for attr in list(obj_dict.keys()):
+            if attr not in attributes:
+                obj_dict.pop(attr, None)
+
+    if hasattr(obj, 'DICT_TO_LIST'):
+        for attr in obj.DICT_TO_LIST:
+            if attr in obj_dict:
+                obj_dict[attr] = list(obj_dict[attr].values())
+
+    return obj_dict
+
+
+def compile_fields_serializer(cls, attributes=None):
+    """ Returns serializer of entities with __slots__ by the tuple of their fields, entities with __dict__ are
+    encoded by the generic serializer.
+    """
+    if cls.__dictoffset__:
+        return lambda entity: generic_serializer(entity, attributes)
+    protected = getattr(cls, 'PROTECTED', ())
+    fields = tuple(
+        field for field in get_fields(cls) if field not in protected and (not attributes or field in attributes)
+    )
+    dict_to_list = tuple(attr for attr in getattr(cls, 'DICT_TO_LIST', ()) if attr in fields)
+    get_values = operator.attrgetter(*fields)
+
+    def serializer(entity):
+        obj_dict = dict(zip(fields, get_values(entity)))
+        for attr in dict_to_list:
+            obj_dict[attr] = list(obj_dict[attr].values())
+        return obj_dict
+
+    return serializer
+
+
+def fields_serializer(obj, attributes=None):
+    key = type(obj) if attributes is None else (type(obj), attributes)
+    serializer = FIELDS_SERIALIZERS.get(key, None)
+    if serializer is None:
+        serializer = FIELDS_SERIALIZERS[key] = compile_fields_serializer(type(obj), attributes)
+    return serializer(obj)
+
+
+def to_dict_entity(value):
+    """ Returns copy of the value where entities (nested ones too) keep their attributes in __dict__.
+    """
+    if isinstance(value, dict):
+        return {key: to_dict_entity(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [to_dict_entity(item) for item in value]
+    # Server's modules import entities without 'server' package, so the entities are found by duck typing:
+    if not hasattr(value, 'default_serializer'):
+        return value
+    cls = type(value)
+    if cls not in DICT_ENTITY_CLASSES:
+        DICT_ENTITY_CLASSES[cls] = type(cls.__name__, (Message, ), {
+            'PROTECTED': getattr(cls, 'PROTECTED', ()), 'DICT_TO_LIST': getattr(cls, 'DICT_TO_LIST', ()),
+        })
+    entity = DICT_ENTITY_CLASSES[cls]()
+    fields = value.__dict__ if hasattr(value, '__dict__') else get_fields(cls)
+    for field in fields:
+        if hasattr(value, field):
+            setattr(entity, field, to_dict_entity(getattr(value, field)))
+    return entity
+
+
+def generic_serialize(game_map, layer, encoding, serializer=generic_serializer):
+    obj_dict = serializer(game_map, attributes=frozenset(Map.LAYER_ATTRIBUTES[layer]))
+    if encoding == Encoding.COMPACT_JSON:
+        return json.dumps(obj_dict, separators=(',', ':'), default=serializer)
+    elif encoding == Encoding.MSGPACK:
+        return msgpack.packb(obj_dict, default=serializer)
+    return json.dumps(obj_dict, sort_keys=True, indent=4, default=serializer)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures serialization of map layer 1.')
+    parser.add_argument('--map', default='map04', help='name of the map')
+    parser.add_argument('--number', type=int, default=200, help='number of serializations for each encoding')
+    args = parser.parse_args()
+
+    map_db.generate_maps(map_names=[args.map, ])
+    num_players = len(Map(name=args.map).towns)
+    game = Game('BENCHMARK', observed=True, map_name=args.map, num_players=num_players)
+    for i in range(num_players):
+        game.add_player(Player('BENCHMARK_{}'.format(i), idx=i + 1))
+    game_map = game.map
+    dict_map = to_dict_entity(game_map)
+    attributes = Map.LAYER_ATTRIBUTES[1]
+
+    encodings = [Encoding.JSON, Encoding.COMPACT_JSON] + ([Encoding.MSGPACK] if msgpack is not None else [])
+    for encoding in encodings:
+        compiled = game_map.serialize_layer(1, encoding)
+        assert (
+            compiled == dict_map.serialize(encoding, attributes) == generic_serialize(dict_map, 1, encoding) ==
+            generic_serialize(game_map, 1, encoding, serializer=fields_serializer)
+        ), 'Serialized layers differ, encoding: {!r}'.format(encoding)
+        times = [
+            timeit.timeit(serialize, number=args.number) * 1000 / args.number for serialize in (
+                lambda: generic_serialize(dict_map, 1, encoding),
+                lambda: dict_map.serialize(encoding, attributes),
+                lambda: generic_serialize(game_map, 1, encoding, serializer=fields_serializer),
+                lambda: game_map.serialize_layer(1, encoding),
+            )
+        ]
+        print(
+            '{!r}: generic {:.3f} ms, compiled (__dict__) {:.3f} ms, '
+            'fields tuple (__slots__) {:.3f} ms, compiled (__slots__) {:.3f} ms'.format(encoding, *times)
+        )
+    game.delete()
+
+
+if __name__ == '__main__':
+    main()